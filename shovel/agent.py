@@ -2,24 +2,80 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import os
 import re
 import time
+from dataclasses import dataclass
 from typing import Any
 
-from shovel.prompt import SYSTEM_PROMPT, USER_PROMPT_TEMPLATE
+from shovel.cache import PackageCache
+from shovel.checkpoint import CheckpointStore
+from shovel.hooks import ToolOutputConfig, ToolOutputStats, make_bash_input_hook, make_tool_output_hook
+from shovel.ledger import AGENT_ERROR, BUDGET_EXCEEDED, INTERRUPTED, PARSE_FAILED, SUCCESS
+from shovel.progress import AGENT, ProgressTracker, phase_for_tool
+from shovel.prompt import (
+    NEXT_INSTANCE_PROMPT_TEMPLATE,
+    PACKAGE_CACHE_PROMPT_TEMPLATE,
+    PRIOR_ATTEMPT_TEMPLATE,
+    RESUME_PROMPT_TEMPLATE,
+    SPECULATIVE_ATTEMPT_TEMPLATE,
+    SYSTEM_PROMPT,
+    USER_PROMPT_TEMPLATE,
+)
 from shovel.utils import detect_language, get_modified_files
+from shovel.workspace import Workspace
 
 logger = logging.getLogger(__name__)
 
+# Minimum turn budget granted to a resumed session, however many turns it used.
+MIN_RESUME_TURNS = 10
+
+# ResultMessage subtypes reported when the agent ran out of turns or budget.
+BUDGET_SUBTYPES = ("error_max_turns", "error_max_budget_usd")
+
+# List prices in USD per million input/output tokens, by model name prefix
+# (longest match wins). Only used to estimate the cost of a session that ended
+# without a ResultMessage, e.g. a cancelled speculative attempt.
+MODEL_PRICES = {
+    "claude-opus-4-5": (5.0, 25.0),
+    "claude-opus-4-6": (5.0, 25.0),
+    "claude-opus-4": (15.0, 75.0),
+    "claude-sonnet-4": (3.0, 15.0),
+    "claude-3-7-sonnet": (3.0, 15.0),
+    "claude-haiku-4-5": (1.0, 5.0),
+    "claude-3-5-haiku": (0.8, 4.0),
+}
+
+# Cache reads and (5-minute) cache writes, relative to the input price.
+CACHE_READ_FACTOR = 0.1
+CACHE_WRITE_FACTOR = 1.25
+
+
+@dataclass
+class AgentRun:
+    """Outcome of one agent run."""
+
+    output: dict | None
+    status: str
+    num_turns: int = 0
+    cost_usd: float | None = None
+    duration_s: float = 0.0
+    session_id: str | None = None
+    last_text: str | None = None
+    model: str | None = None
+    trimmed_outputs: int = 0
+    trimmed_chars: int = 0
+
 
 def _sdk_symbols() -> dict[str, Any]:
     """Load SDK symbols lazily so CLI help works without optional deps."""
     from claude_agent_sdk import (  # type: ignore
         AssistantMessage,
         ClaudeAgentOptions,
+        HookMatcher,
         ResultMessage,
         SystemMessage,
         TextBlock,
@@ -33,6 +89,7 @@ def _sdk_symbols() -> dict[str, Any]:
     return {
         "query": query,
         "ClaudeAgentOptions": ClaudeAgentOptions,
+        "HookMatcher": HookMatcher,
         "ResultMessage": ResultMessage,
         "AssistantMessage": AssistantMessage,
         "UserMessage": UserMessage,
@@ -132,12 +189,41 @@ def _summarize_tool_input(tool_name: str, input_data: dict) -> str:
     return str(input_data)[:100]
 
 
-def build_user_prompt(instance: dict, build_dir: str) -> str:
-    """Build the user prompt from an SWE-bench instance."""
+def estimate_cost_usd(model: str, usage_by_message: dict[str, dict]) -> float | None:
+    """Cost of the given per-message token usage at list prices; None for unknown models."""
+    prefix = max((p for p in MODEL_PRICES if model.startswith(p)), key=len, default=None)
+    if prefix is None:
+        return None
+    input_price, output_price = MODEL_PRICES[prefix]
+    total = 0.0
+    for usage in usage_by_message.values():
+        total += (usage.get("input_tokens") or 0) * input_price
+        total += (usage.get("cache_read_input_tokens") or 0) * input_price * CACHE_READ_FACTOR
+        total += (usage.get("cache_creation_input_tokens") or 0) * input_price * CACHE_WRITE_FACTOR
+        total += (usage.get("output_tokens") or 0) * output_price
+    return round(total / 1_000_000, 6)
+
+
+def image_tag_for(instance_id: str, attempt: int) -> str:
+    """Docker image tag a speculative attempt validates with."""
+    return f"test_{instance_id}_attempt{attempt}".lower()
+
+
+def build_user_prompt(instance: dict, build_dir: str, metadata: dict | None = None) -> str:
+    """Build the user prompt from an SWE-bench instance.
+
+    ``metadata`` holds the instance's precomputed ``test_files`` and
+    ``language`` (see ``shovel.metadata``); without it they are derived from
+    ``test_patch`` here.
+    """
     test_patch = instance.get("test_patch", "")
     patch = instance.get("patch", "")
-    test_files = get_modified_files(test_patch)
-    language = detect_language(test_files)
+    if metadata is not None:
+        test_files = metadata["test_files"]
+        language = metadata["language"]
+    else:
+        test_files = get_modified_files(test_patch)
+        language = detect_language(test_files)
 
     problem_statement = instance.get("problem_statement", "")
 
@@ -194,23 +280,159 @@ def _parse_output_from_final_assistant_text(text: str) -> dict | None:
     return None
 
 
+def postprocess_output(instance_id: str, last_assistant_text: str | None) -> dict | None:
+    """Parse and check the final assistant message; None if it is not a usable config.
+
+    Pure function of the message text, shared by live runs and ``shovel replay``.
+    """
+    output = None
+    if last_assistant_text is not None:
+        output = _parse_output_from_final_assistant_text(last_assistant_text)
+        if output is not None:
+            logger.info("[%s] Parsed output JSON from final assistant message", instance_id)
+
+    if output is None:
+        logger.error("[%s] Failed to parse output JSON from final assistant message", instance_id)
+        return None
+
+    if not isinstance(output, dict):
+        logger.error("[%s] Parsed output is not a dict: %s", instance_id, type(output))
+        return None
+
+    required_keys = ["dockerfile", "eval_script", "setup_scripts"]
+    for key in required_keys:
+        if key not in output:
+            logger.error("[%s] Missing key in output: %s", instance_id, key)
+            return None
+
+    if "setup_repo.sh" not in output.get("setup_scripts", {}):
+        logger.error("[%s] Missing setup_repo.sh in setup_scripts", instance_id)
+        return None
+
+    if "OMNIGRIL_EXIT_CODE" not in output["eval_script"]:
+        logger.warning("[%s] eval_script missing OMNIGRIL_EXIT_CODE, injecting...", instance_id)
+        output["eval_script"] = (
+            output["eval_script"].rstrip() + '\nrc=$?\necho "OMNIGRIL_EXIT_CODE=$rc"\n'
+        )
+    return output
+
+
 async def run_agent(
     instance: dict,
     repo_dir: str,
     model: str,
     max_turns: int = 50,
     log_dir: str | None = None,
-    project_dir: str = ".",
-) -> dict | None:
-    """Run Claude agent to generate Docker configuration."""
+    workspace: Workspace | None = None,
+    checkpoints: CheckpointStore | None = None,
+    tool_output: ToolOutputConfig | None = None,
+    max_budget_usd: float | None = None,
+    prior_attempt: dict | None = None,
+    attempt: int = 0,
+    attempt_hint: str | None = None,
+    package_cache: PackageCache | None = None,
+    batch_session_id: str | None = None,
+    progress: ProgressTracker | None = None,
+    tier: int = 0,
+    final_tier: bool = True,
+    cancelled_runs: list[AgentRun] | None = None,
+    metadata: dict | None = None,
+) -> AgentRun:
+    """Run Claude agent to generate Docker configuration and classify the outcome."""
+    if workspace is None:
+        # No caller-owned workspace: use a private one, removed after the run.
+        workspace = Workspace()
+        try:
+            return await run_agent(
+                instance,
+                repo_dir,
+                model=model,
+                max_turns=max_turns,
+                log_dir=log_dir,
+                workspace=workspace,
+                checkpoints=checkpoints,
+                tool_output=tool_output,
+                max_budget_usd=max_budget_usd,
+                prior_attempt=prior_attempt,
+                attempt=attempt,
+                attempt_hint=attempt_hint,
+                package_cache=package_cache,
+                batch_session_id=batch_session_id,
+                progress=progress,
+                tier=tier,
+                final_tier=final_tier,
+                cancelled_runs=cancelled_runs,
+                metadata=metadata,
+            )
+        finally:
+            workspace.cleanup()
+
     sdk = _sdk_symbols()
     instance_id = instance["instance_id"]
-    build_dir = os.path.join(os.path.abspath(project_dir), "tmp", f"docker_build_{instance_id}")
-    user_prompt = build_user_prompt(instance, build_dir)
+    # Speculative attempts (attempt > 0) get their own build dir; the caller releases it.
+    build_dir = workspace.allocate(instance_id, attempt)
+
+    checkpoint = checkpoints.load(instance_id) if checkpoints is not None else None
+    resume_session_id = None
+    prior_turns = 0
+    batched = False
+    # A checkpointed session of this model (interrupted or failed earlier run) is resumed.
+    if checkpoint and checkpoint.get("session_id") and checkpoint.get("model") == model:
+        resume_session_id = checkpoint["session_id"]
+        prior_turns = checkpoint.get("num_turns", 0)
+        user_prompt = RESUME_PROMPT_TEMPLATE.format(
+            instance_id=instance_id,
+            num_turns=prior_turns,
+            build_dir=build_dir,
+        )
+        max_turns = max(max_turns - prior_turns, MIN_RESUME_TURNS)
+    elif batch_session_id and prior_attempt is None and not attempt:
+        # Continue the session of the previous instance of this repo (see shovel.batch).
+        resume_session_id = batch_session_id
+        batched = True
+        user_prompt = NEXT_INSTANCE_PROMPT_TEMPLATE.format(
+            repo=instance["repo"],
+            base_commit=instance["base_commit"],
+            build_dir=build_dir,
+            instance_prompt=build_user_prompt(instance, build_dir, metadata),
+        )
+    else:
+        user_prompt = build_user_prompt(instance, build_dir, metadata)
+        # Findings of a cheaper cascade tier that failed, for the agent to build on.
+        if prior_attempt is not None:
+            user_prompt += PRIOR_ATTEMPT_TEMPLATE.format(build_dir=build_dir, **prior_attempt)
+        if attempt:
+            user_prompt += SPECULATIVE_ATTEMPT_TEMPLATE.format(
+                build_dir=build_dir,
+                image_tag=image_tag_for(instance_id, attempt),
+                hint=attempt_hint or "",
+            )
+
+    # Oversized tool outputs are trimmed before they reach the model context:
+    # Bash commands are rewritten, other tools' results replaced after the fact.
+    tool_stats = ToolOutputStats()
+    hooks = {}
+    if tool_output is not None:
+        if tool_output.limits.get("Bash"):
+            hooks["PreToolUse"] = [
+                sdk["HookMatcher"](matcher="Bash", hooks=[make_bash_input_hook(instance_id, tool_output)])
+            ]
+        trimmed_tools = [tool for tool, limit in tool_output.limits.items() if limit and tool != "Bash"]
+        if trimmed_tools:
+            hooks["PostToolUse"] = [
+                sdk["HookMatcher"](
+                    matcher="|".join(trimmed_tools),
+                    hooks=[make_tool_output_hook(instance_id, tool_output)],
+                )
+            ]
+
+    system_prompt = SYSTEM_PROMPT
+    if package_cache is not None:
+        system_prompt += PACKAGE_CACHE_PROMPT_TEMPLATE.format(build_args=package_cache.docker_build_args())
 
     options = sdk["ClaudeAgentOptions"](
         model=model,
-        system_prompt=SYSTEM_PROMPT,
+        system_prompt=system_prompt,
         allowed_tools=[
             "Bash",
             "Read",
@@ -228,15 +450,49 @@ async def run_agent(
         permission_mode="bypassPermissions",
         cwd=repo_dir,
         max_turns=max_turns,
+        resume=resume_session_id,
+        hooks=hooks or None,
+        max_budget_usd=max_budget_usd,
     )
 
-    logger.info("[%s] Starting agent (model=%s, cwd=%s)", instance_id, model, repo_dir)
+    if batched:
+        logger.info(
+            "[%s] Continuing batch session %s (model=%s, cwd=%s)",
+            instance_id,
+            resume_session_id,
+            model,
+            repo_dir,
+        )
+    elif resume_session_id:
+        logger.info(
+            "[%s] Resuming agent session %s after %s turns (model=%s, cwd=%s)",
+            instance_id,
+            resume_session_id,
+            prior_turns,
+            model,
+            repo_dir,
+        )
+    else:
+        logger.info("[%s] Starting agent (model=%s, cwd=%s)", instance_id, model, repo_dir)
     start_time = time.time()
-    log_file = _open_trajectory_log(instance_id, user_prompt, log_dir, start_time)
+    log_file = _open_trajectory_log(
+        instance_id,
+        user_prompt,
+        log_dir,
+        start_time,
+        resume_session_id=resume_session_id,
+        attempt=attempt,
+        batched=batched,
+        tier=tier,
+        final_tier=final_tier,
+    )
 
     result_message = None
     last_assistant_text = None
     turn_count = 0
+    session_id = resume_session_id
+    # Latest usage per API message; a response split into several messages repeats it.
+    usage_by_message: dict[str, dict] = {}
     try:
         async for message in sdk["query"](prompt=user_prompt, options=options):
             serialized = _serialize_message(message, sdk)
@@ -246,9 +502,25 @@ async def run_agent(
             if isinstance(message, sdk["ResultMessage"]):
                 result_message = message
                 break
+            if isinstance(message, sdk["SystemMessage"]) and message.subtype == "init":
+                session_id = message.data.get("session_id") or session_id
+                if checkpoints is not None and session_id:
+                    checkpoints.save(
+                        instance_id,
+                        session_id=session_id,
+                        model=model,
+                        num_turns=prior_turns,
+                        status="running",
+                    )
             if isinstance(message, sdk["AssistantMessage"]):
+                usage = getattr(message, "usage", None)
+                if usage:
+                    usage_by_message[getattr(message, "message_id", None) or str(len(usage_by_message))] = usage
                 turn_count += 1
+                if checkpoints is not None:
+                    checkpoints.save(instance_id, num_turns=prior_turns + turn_count)
                 text_blocks = []
+                phase = AGENT
                 for block in message.content:
                     if isinstance(block, sdk["TextBlock"]):
                         text_blocks.append(block.text)
@@ -263,54 +535,131 @@ async def run_agent(
                             block.name,
                             input_summary,
                         )
+                        phase = phase_for_tool(block.name, block.input)
+                if progress is not None:
+                    progress.update(instance_id, phase, turn=prior_turns + turn_count)
                 if text_blocks:
                     last_assistant_text = "\n".join(text_blocks)
             elif isinstance(message, sdk["UserMessage"]) and isinstance(message.content, list):
                 for block in message.content:
+                    if isinstance(block, sdk["ToolResultBlock"]):
+                        tool_stats.observe(block.content)
                     if isinstance(block, sdk["ToolResultBlock"]) and block.is_error:
                         err_preview = str(block.content)[:150] if block.content else ""
                         logger.warning("[%s] TOOL_ERROR: %s", instance_id, err_preview)
+    except asyncio.CancelledError:
+        logger.warning(
+            "[%s] Agent interrupted after %s turns, checkpointing",
+            instance_id,
+            prior_turns + turn_count,
+        )
+        _append_to_log(log_file, {"role": "error", "error": "interrupted"})
+        _close_trajectory_log(log_file, start_time)
+        if checkpoints is not None:
+            checkpoints.save(instance_id, status=INTERRUPTED)
+        if cancelled_runs is not None:
+            cancelled_runs.append(
+                AgentRun(
+                    None,
+                    INTERRUPTED,
+                    turn_count,
+                    estimate_cost_usd(model, usage_by_message),
+                    time.time() - start_time,
+                    session_id,
+                    last_text=last_assistant_text,
+                    model=model,
+                )
+            )
+        raise
     except Exception as exc:
         logger.error("[%s] Agent error: %s", instance_id, exc)
         _append_to_log(log_file, {"role": "error", "error": str(exc)})
         _close_trajectory_log(log_file, start_time)
-        return None
-
-    _close_trajectory_log(log_file, start_time)
+        if resume_session_id and turn_count == 0 and (checkpoints is not None or batched):
+            logger.warning("[%s] Could not resume session %s, starting over", instance_id, resume_session_id)
+            if checkpoints is not None:
+                checkpoints.clear(instance_id)
+            return await run_agent(
+                instance,
+                repo_dir,
+                model=model,
+                max_turns=max_turns + prior_turns,
+                log_dir=log_dir,
+                workspace=workspace,
+                checkpoints=checkpoints,
+                tool_output=tool_output,
+                max_budget_usd=max_budget_usd,
+                prior_attempt=prior_attempt,
+                attempt=attempt,
+                attempt_hint=attempt_hint,
+                package_cache=package_cache,
+                batch_session_id=batch_session_id if not batched else None,
+                progress=progress,
+                tier=tier,
+                final_tier=final_tier,
+                cancelled_runs=cancelled_runs,
+                metadata=metadata,
+            )
+        if checkpoints is not None:
+            checkpoints.save(instance_id, status=AGENT_ERROR)
+        return AgentRun(
+            None,
+            AGENT_ERROR,
+            turn_count,
+            estimate_cost_usd(model, usage_by_message),
+            time.time() - start_time,
+            session_id,
+            last_text=last_assistant_text,
+            model=model,
+        )
 
-    output = None
-    if result_message is not None:
-        if result_message.is_error:
-            logger.error("[%s] Agent returned error: %s", instance_id, result_message.result)
-            return None
-    if last_assistant_text is not None:
-        output = _parse_output_from_final_assistant_text(last_assistant_text)
-        if output is not None:
-            logger.info("[%s] Parsed output JSON from final assistant message", instance_id)
+    cost = result_message.total_cost_usd if result_message is not None else estimate_cost_usd(model, usage_by_message)
+    turns = result_message.num_turns if result_message is not None else turn_count
+    if tool_stats.trims:
+        _append_to_log(
+            log_file,
+            {
+                "role": "tool_output_trimming",
+                "trimmed_outputs": len(tool_stats.trims),
+                "trimmed_chars": tool_stats.trimmed_chars,
+            },
+        )
+        logger.info(
+            "[%s] %s tool outputs reached the agent trimmed, %s chars shorter",
+            instance_id,
+            len(tool_stats.trims),
+            tool_stats.trimmed_chars,
+        )
 
-    if output is None:
-        logger.error("[%s] Failed to parse output JSON from final assistant message", instance_id)
-        return None
+    _close_trajectory_log(log_file, start_time)
+    if checkpoints is not None:
+        checkpoints.save(instance_id, status="finished")
 
-    if not isinstance(output, dict):
-        logger.error("[%s] Parsed output is not a dict: %s", instance_id, type(output))
-        return None
+    elapsed = time.time() - start_time
 
-    required_keys = ["dockerfile", "eval_script", "setup_scripts"]
-    for key in required_keys:
-        if key not in output:
-            logger.error("[%s] Missing key in output: %s", instance_id, key)
-            return None
+    def _failed(status: str) -> AgentRun:
+        return AgentRun(
+            None,
+            status,
+            turns,
+            cost,
+            elapsed,
+            session_id,
+            last_assistant_text,
+            model,
+            len(tool_stats.trims),
+            tool_stats.trimmed_chars,
+        )
 
-    if "setup_repo.sh" not in output.get("setup_scripts", {}):
-        logger.error("[%s] Missing setup_repo.sh in setup_scripts", instance_id)
-        return None
+    if result_message is not None and result_message.is_error:
+        logger.error("[%s] Agent returned error: %s", instance_id, result_message.result)
+        if result_message.subtype in BUDGET_SUBTYPES:
+            return _failed(BUDGET_EXCEEDED)
+        return _failed(AGENT_ERROR)
 
-    if "OMNIGRIL_EXIT_CODE" not in output["eval_script"]:
-        logger.warning("[%s] eval_script missing OMNIGRIL_EXIT_CODE, injecting...", instance_id)
-        output["eval_script"] = (
-            output["eval_script"].rstrip() + '\nrc=$?\necho "OMNIGRIL_EXIT_CODE=$rc"\n'
-        )
+    output = postprocess_output(instance_id, last_assistant_text)
+    if output is None:
+        return _failed(PARSE_FAILED)
 
     if result_message is None:
         logger.warning(
@@ -318,9 +667,6 @@ async def run_agent(
             instance_id,
         )
 
-    cost = result_message.total_cost_usd if result_message is not None else None
-    turns = result_message.num_turns if result_message is not None else turn_count
-    elapsed = time.time() - start_time
     elapsed_str = f"{elapsed:.1f}s"
     if elapsed >= 60:
         elapsed_str = f"{int(elapsed // 60)}m{int(elapsed % 60)}s"
@@ -329,22 +675,60 @@ async def run_agent(
     else:
         logger.info("[%s] Agent completed: %s turns, duration=%s", instance_id, turns, elapsed_str)
 
-    return output
+    if checkpoints is not None:
+        checkpoints.clear(instance_id)
+    return AgentRun(
+        output,
+        SUCCESS,
+        turns,
+        cost,
+        elapsed,
+        session_id,
+        last_assistant_text,
+        model,
+        len(tool_stats.trims),
+        tool_stats.trimmed_chars,
+    )
 
 
-def _open_trajectory_log(instance_id: str, user_prompt: str, log_dir: str | None, start_time: float | None = None):
-    """Open a JSONL trajectory log file and write the header line."""
+def _open_trajectory_log(
+    instance_id: str,
+    user_prompt: str,
+    log_dir: str | None,
+    start_time: float | None = None,
+    resume_session_id: str | None = None,
+    attempt: int = 0,
+    batched: bool = False,
+    tier: int = 0,
+    final_tier: bool = True,
+):
+    """Open a JSONL trajectory log file and write the header line.
+
+    A resumed session appends to the existing log so the file keeps the whole
+    trajectory; cascade tiers and speculative attempts log to their own
+    ``.tierN`` and ``.attemptN`` files. An instance continuing a batch session
+    starts its own log.
+    """
     if log_dir is None:
         return None
     os.makedirs(log_dir, exist_ok=True)
     safe_id = instance_id.replace("/", "__")
+    if tier:
+        safe_id += f".tier{tier}"
+    if attempt:
+        safe_id += f".attempt{attempt}"
     log_path = os.path.join(log_dir, f"{safe_id}.jsonl")
     try:
-        handle = open(log_path, "w")
+        handle = open(log_path, "a" if resume_session_id and not batched else "w")
         header = {
             "type": "header",
             "instance_id": instance_id,
             "user_prompt": user_prompt,
+            "resume_session_id": resume_session_id,
+            "attempt": attempt,
+            "tier": tier,
+            "final_tier": final_tier,
+            "batched": batched,
             "start_time": start_time,
             "start_time_human": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))
             if start_time
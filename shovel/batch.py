@@ -0,0 +1,115 @@
+"""Batched agent sessions: several instances of one repo handled by one session."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+from collections.abc import Coroutine
+from dataclasses import dataclass, field
+from typing import Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class RepoBatch:
+    """A sequence of same-repo instances sharing one checkout and agent session.
+
+    Instances run one at a time under ``lock``. Each instance that succeeds on
+    ``model`` leaves its ``session_id`` here, and the next instance resumes that
+    session instead of exploring the repo again. A failed instance resets the
+    session, so the next one starts fresh in the same checkout. ``run_id``
+    keeps checkouts of concurrent runs or server jobs apart.
+    """
+
+    repo: str
+    index: int
+    model: str
+    instance_ids: list[str]
+    run_id: str = ""
+    session_id: str | None = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def checkout_name(self) -> str:
+        """Directory name of the checkout shared by the batch."""
+        name = f"{self.repo.replace('/', '__')}__batch{self.index}"
+        return f"{name}__{self.run_id}" if self.run_id else name
+
+
+def plan_batches(
+    instances: dict[str, dict],
+    batch_size: int,
+    model: str,
+    exclude_repos: set[str] | None = None,
+    run_id: str = "",
+) -> dict[str, RepoBatch]:
+    """Group instances into per-repo batches of at most ``batch_size``.
+
+    Instances within a repo are ordered by ``created_at`` so each checkout moves
+    forward in history. Returns the batch for every batched instance id; repos
+    with a single pending instance and ``exclude_repos`` are left unbatched.
+    """
+    by_repo: dict[str, list[dict]] = {}
+    for instance in instances.values():
+        if exclude_repos and instance["repo"] in exclude_repos:
+            continue
+        by_repo.setdefault(instance["repo"], []).append(instance)
+
+    batches: dict[str, RepoBatch] = {}
+    count = 0
+    for repo, repo_instances in by_repo.items():
+        if len(repo_instances) < 2:
+            continue
+        repo_instances.sort(key=lambda item: str(item.get("created_at") or ""))
+        for index, offset in enumerate(range(0, len(repo_instances), batch_size)):
+            chunk = [item["instance_id"] for item in repo_instances[offset : offset + batch_size]]
+            if len(chunk) < 2:
+                continue
+            batch = RepoBatch(repo, index, model, chunk, run_id)
+            count += 1
+            for instance_id in chunk:
+                batches[instance_id] = batch
+    if batches:
+        logger.info("Batched %s instances into %s repo sessions", len(batches), count)
+    return batches
+
+
+def batch_order(instances: dict[str, dict], batches: dict[str, RepoBatch]) -> list[str]:
+    """Instance ids in input order, with each batch's members in batch order.
+
+    Tasks must be created in this order: the batch lock admits waiters first
+    come, first served.
+    """
+    order: list[str] = []
+    seen: set[str] = set()
+    for instance_id in instances:
+        batch = batches.get(instance_id)
+        for member in batch.instance_ids if batch is not None else [instance_id]:
+            if member not in seen:
+                seen.add(member)
+                order.append(member)
+    return order
+
+
+def remove_checkouts(batches: dict[str, RepoBatch], repo_root_dir: str) -> None:
+    """Remove the shared checkouts of a run's batches."""
+    for batch in {id(batch): batch for batch in batches.values()}.values():
+        shutil.rmtree(os.path.join(repo_root_dir, batch.checkout_name), ignore_errors=True)
+
+
+async def run_in_batch(batch: RepoBatch, work: Coroutine[Any, Any, T]) -> T:
+    """Await ``work`` once every earlier instance of the batch has finished."""
+    try:
+        await batch.lock.acquire()
+    except asyncio.CancelledError:
+        work.close()
+        raise
+    try:
+        return await work
+    finally:
+        batch.lock.release()
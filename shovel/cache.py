@@ -0,0 +1,274 @@
+"""Local caching proxy for PyPI and apt, shared by all validation builds.
+
+Agents validate every config with ``docker build``, and each build's
+``setup_repo.sh`` reinstalls the same wheels and .deb packages. The cache
+runs in a background thread of the shovel process and serves two things:
+
+- ``/pypi/simple/<project>/``: a PyPI simple-index mirror whose file links are
+  rewritten to ``/pypi/files/...`` so wheels and sdists are stored on disk after
+  the first download. Only http(s) links that the mirror rewrote into an index
+  page it served are fetched. The upstream index is configurable, so a local
+  stand-in index (e.g. ``python -m http.server`` over a ``simple/`` tree) works
+  in tests.
+- A plain HTTP forward proxy (``http_proxy``) for apt, which caches ``.deb``
+  files and passes everything else through. HTTPS ``CONNECT`` is not supported.
+
+Builds opt in through build args; see ``PackageCache.docker_build_args``.
+The server binds to 127.0.0.1, so builds reach it with ``--network host``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PYPI_UPSTREAM = "https://pypi.org"
+
+# How long a cached simple-index page is served before it is refetched.
+INDEX_TTL_SECONDS = 600
+
+# apt paths worth caching: package archives are immutable once published.
+APT_CACHEABLE_RE = re.compile(r"\.(u?deb)$")
+
+HREF_RE = re.compile(r'href="([^"]+)"')
+
+UPSTREAM_TIMEOUT = 120
+
+
+class PackageCache:
+    """Caching PyPI mirror and apt proxy listening on a local port."""
+
+    def __init__(self, cache_dir: str, port: int = 0, pypi_upstream: str = DEFAULT_PYPI_UPSTREAM):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.pypi_upstream = pypi_upstream.rstrip("/")
+        self.requested_port = port
+        self.stats: dict[str, dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+        self._path_locks: dict[str, threading.Lock] = {}
+        # Upstream file URLs linked from index pages served so far.
+        self._served_files: set[str] = set()
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1] if self._server is not None else self.requested_port
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        """Start serving in a daemon thread."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        handler = type("PackageCacheHandler", (_Handler,), {"cache": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.requested_port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="shovel-package-cache",
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info(
+            "Package cache listening on %s (dir=%s, pypi=%s)",
+            self.url,
+            self.cache_dir,
+            self.pypi_upstream,
+        )
+
+    def stop(self) -> None:
+        """Stop serving; cached files stay on disk for the next run."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def docker_build_args(self) -> str:
+        """Flags that route a ``docker build`` through this cache."""
+        return (
+            "--network host "
+            f"--build-arg http_proxy={self.url} "
+            f"--build-arg HTTP_PROXY={self.url} "
+            "--build-arg no_proxy=127.0.0.1,localhost "
+            "--build-arg NO_PROXY=127.0.0.1,localhost "
+            f"--build-arg PIP_INDEX_URL={self.url}/pypi/simple/ "
+            "--build-arg PIP_TRUSTED_HOST=127.0.0.1"
+        )
+
+    def count(self, kind: str, outcome: str, size: int = 0) -> None:
+        with self._stats_lock:
+            entry = self.stats.setdefault(kind, {"hits": 0, "misses": 0, "errors": 0, "bytes_served": 0})
+            entry[outcome] += 1
+            entry["bytes_served"] += size
+
+    def log_summary(self) -> None:
+        """Log hit rates per kind of request."""
+        for kind, entry in sorted(self.stats.items()):
+            lookups = entry["hits"] + entry["misses"]
+            rate = 100 * entry["hits"] / lookups if lookups else 0.0
+            logger.info(
+                "Package cache %s: %s hits / %s lookups (%.0f%%), %s errors, %.1f MB served",
+                kind,
+                entry["hits"],
+                lookups,
+                rate,
+                entry["errors"],
+                entry["bytes_served"] / 1e6,
+            )
+
+    def _lock_for(self, path: str) -> threading.Lock:
+        with self._stats_lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def cache_path(self, kind: str, url: str) -> str:
+        parts = urlsplit(url)
+        digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+        name = os.path.basename(parts.path.rstrip("/")) or "index"
+        return os.path.join(self.cache_dir, kind, parts.netloc, digest, name)
+
+    def fetch(self, kind: str, url: str, ttl: float | None = None) -> tuple[str, bool]:
+        """Return a local path holding ``url``, downloading it on a miss.
+
+        ``ttl`` expires cached copies (None keeps them forever). Returns the
+        path and whether it was a cache hit. Concurrent misses on one URL
+        download it once.
+        """
+        path = self.cache_path(kind, url)
+        with self._lock_for(path):
+            if os.path.exists(path) and (ttl is None or time.time() - os.path.getmtime(path) < ttl):
+                return path, True
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.part"
+            request = urllib.request.Request(url, headers={"User-Agent": "shovel-package-cache"})
+            with urllib.request.urlopen(request, timeout=UPSTREAM_TIMEOUT) as response, open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response, f)
+            os.replace(tmp_path, path)
+            return path, False
+
+    def file_url(self, upstream_url: str) -> str:
+        """Local URL under ``/pypi/files/`` that proxies an upstream file URL."""
+        parts = urlsplit(upstream_url)
+        local = f"{self.url}/pypi/files/{parts.scheme}/{parts.netloc}{parts.path}"
+        return f"{local}#{parts.fragment}" if parts.fragment else local
+
+    def serves_file(self, upstream_url: str) -> bool:
+        """Whether ``upstream_url`` was linked from an index page this cache served."""
+        with self._stats_lock:
+            return upstream_url in self._served_files
+
+    def rewrite_index(self, html: str, page_url: str) -> str:
+        """Point every http(s) file link of a simple-index page at this cache."""
+        served = set()
+
+        def _rewrite(match: re.Match) -> str:
+            target = urljoin(page_url, match.group(1).replace("&amp;", "&"))
+            parts = urlsplit(target)
+            if parts.scheme not in ("http", "https"):
+                return match.group(0)
+            served.add(f"{parts.scheme}://{parts.netloc}{parts.path}")
+            return f'href="{self.file_url(target)}"'
+
+        html = HREF_RE.sub(_rewrite, html)
+        with self._stats_lock:
+            self._served_files.update(served)
+        return html
+
+
+class _Handler(BaseHTTPRequestHandler):
+    cache: PackageCache
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug("package cache: " + format, *args)
+
+    def do_GET(self) -> None:
+        try:
+            if self.path.startswith("http://"):
+                self._proxy_apt(self.path)
+            elif self.path.startswith("/pypi/simple/"):
+                self._serve_index(self.path[len("/pypi/simple/") :])
+            elif self.path.startswith("/pypi/files/"):
+                self._serve_file(self.path[len("/pypi/files/") :])
+            else:
+                self.send_error(404)
+        except urllib.error.HTTPError as exc:
+            self.send_error(exc.code)
+        except Exception as exc:
+            logger.warning("Package cache request %s failed: %s", self.path, exc)
+            self.send_error(502)
+
+    def do_CONNECT(self) -> None:
+        self.send_error(405, "HTTPS proxying is not supported")
+
+    def _send_file(self, path: str, content_type: str) -> None:
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def _serve_index(self, project_path: str) -> None:
+        cache = self.cache
+        upstream_url = f"{cache.pypi_upstream}/simple/{project_path}"
+        try:
+            path, hit = cache.fetch("pypi-index", upstream_url, ttl=INDEX_TTL_SECONDS)
+        except Exception:
+            cache.count("pypi-index", "errors")
+            raise
+        with open(path, encoding="utf-8") as f:
+            body = cache.rewrite_index(f.read(), upstream_url).encode()
+        cache.count("pypi-index", "hits" if hit else "misses", len(body))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_file(self, encoded: str) -> None:
+        scheme, _, rest = encoded.partition("/")
+        upstream_url = f"{scheme}://{rest}"
+        # Only fetch what an index page pointed at, never arbitrary URLs.
+        if scheme not in ("http", "https") or not self.cache.serves_file(upstream_url):
+            self.send_error(403)
+            return
+        try:
+            path, hit = self.cache.fetch("pypi-files", upstream_url)
+        except Exception:
+            self.cache.count("pypi-files", "errors")
+            raise
+        self.cache.count("pypi-files", "hits" if hit else "misses", os.path.getsize(path))
+        self._send_file(path, "application/octet-stream")
+
+    def _proxy_apt(self, url: str) -> None:
+        if APT_CACHEABLE_RE.search(urlsplit(url).path):
+            try:
+                path, hit = self.cache.fetch("apt", url)
+            except Exception:
+                self.cache.count("apt", "errors")
+                raise
+            self.cache.count("apt", "hits" if hit else "misses", os.path.getsize(path))
+            self._send_file(path, "application/vnd.debian.binary-package")
+            return
+        request = urllib.request.Request(url, headers={"User-Agent": self.headers.get("User-Agent", "")})
+        with urllib.request.urlopen(request, timeout=UPSTREAM_TIMEOUT) as response:
+            body = response.read()
+            content_type = response.headers.get("Content-Type", "application/octet-stream")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
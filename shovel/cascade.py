@@ -0,0 +1,113 @@
+"""Model cascade: run instances on a cheap tier first and escalate on failure."""
+
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Longest slice of the previous tier's final message carried into the next prompt.
+MAX_FINDINGS_CHARS = 6000
+
+PARALLEL_FLAGS_RE = re.compile(r"(-n\s*auto|--num-processes=auto|-p\s+auto|-nauto)\b")
+
+
+@dataclass
+class CascadeTier:
+    model: str
+    max_turns: int
+    max_budget_usd: float | None = None
+
+
+def parse_cascade(specs: list[str], default_max_turns: int) -> list[CascadeTier]:
+    """Parse ``MODEL[:TURNS[:BUDGET_USD]]`` specs, cheapest tier first."""
+    tiers = []
+    for spec in specs:
+        parts = spec.split(":")
+        if len(parts) > 3 or not parts[0]:
+            raise ValueError(f"Invalid cascade tier {spec!r}, expected MODEL[:TURNS[:BUDGET_USD]]")
+        try:
+            max_turns = int(parts[1]) if len(parts) > 1 and parts[1] else default_max_turns
+            budget = float(parts[2]) if len(parts) > 2 and parts[2] else None
+        except ValueError:
+            raise ValueError(f"Invalid cascade tier {spec!r}, expected MODEL[:TURNS[:BUDGET_USD]]") from None
+        tiers.append(CascadeTier(parts[0], max_turns, budget))
+    return tiers
+
+
+def static_check_output(output: dict) -> list[str]:
+    """Cheap structural checks on a parsed config; returns a list of problems."""
+    issues = []
+    dockerfile = output.get("dockerfile", "")
+    eval_script = output.get("eval_script", "")
+    setup_script = output.get("setup_scripts", {}).get("setup_repo.sh", "")
+    if "FROM --platform=linux/x86_64" not in dockerfile:
+        issues.append("dockerfile does not use FROM --platform=linux/x86_64")
+    if "setup_repo.sh" not in dockerfile:
+        issues.append("dockerfile does not copy and run setup_repo.sh")
+    if not setup_script.lstrip().startswith("#!/bin/bash"):
+        issues.append("setup_repo.sh does not start with #!/bin/bash")
+    if "/testbed" not in setup_script:
+        issues.append("setup_repo.sh does not set up /testbed")
+    if "EOF_114329324912" not in eval_script:
+        issues.append("eval_script does not apply test_patch with the EOF_114329324912 heredoc")
+    if ">>>>> Start Test Output" not in eval_script or ">>>>> End Test Output" not in eval_script:
+        issues.append("eval_script is missing the test output markers")
+    if PARALLEL_FLAGS_RE.search(eval_script):
+        issues.append("eval_script uses parallel test flags")
+    return issues
+
+
+def summarize_findings(output: dict | None, last_text: str | None, issues: list[str]) -> str:
+    """Describe a failed tier's partial results for the next tier's prompt."""
+    parts = []
+    if issues:
+        parts.append("Problems found in its configuration:\n" + "\n".join(f"- {issue}" for issue in issues))
+    if last_text:
+        text = last_text.strip()
+        if len(text) > MAX_FINDINGS_CHARS:
+            text = "...\n" + text[-MAX_FINDINGS_CHARS:]
+        label = "Its final configuration" if output is not None else "Its final message"
+        parts.append(f"{label}:\n{text}")
+    return "\n\n".join(parts) or "(no findings recorded)"
+
+
+@dataclass
+class CascadeStats:
+    """Per-tier attempts, successes and cost for one run."""
+
+    tiers: list[CascadeTier]
+    attempts: list[int] = field(default_factory=list)
+    successes: list[int] = field(default_factory=list)
+    cost_usd: list[float] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.attempts = [0] * len(self.tiers)
+        self.successes = [0] * len(self.tiers)
+        self.cost_usd = [0.0] * len(self.tiers)
+
+    def record(self, tier_index: int, succeeded: bool, cost_usd: float | None) -> None:
+        self.attempts[tier_index] += 1
+        self.successes[tier_index] += int(succeeded)
+        self.cost_usd[tier_index] += cost_usd or 0.0
+
+    def log_summary(self) -> None:
+        for index, tier in enumerate(self.tiers):
+            attempts = self.attempts[index]
+            if not attempts:
+                continue
+            successes = self.successes[index]
+            cost = self.cost_usd[index]
+            per_success = f"${cost / successes:.4f}" if successes else "n/a"
+            logger.info(
+                "Tier %s (%s): %s/%s succeeded (%.0f%%), $%.4f total, %s per success",
+                index + 1,
+                tier.model,
+                successes,
+                attempts,
+                100 * successes / attempts,
+                cost,
+                per_success,
+            )
@@ -0,0 +1,67 @@
+"""Per-instance agent session checkpoints for resuming interrupted runs."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """Persist in-flight agent session ids and progress, one file per instance."""
+
+    def __init__(self, checkpoint_dir: str | None):
+        self.checkpoint_dir = checkpoint_dir
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def _path(self, instance_id: str) -> str:
+        safe_id = instance_id.replace("/", "__")
+        return os.path.join(self.checkpoint_dir, f"{safe_id}.json")
+
+    def load(self, instance_id: str) -> dict | None:
+        """Return the checkpoint for an instance, or None if there is none."""
+        if self.checkpoint_dir is None:
+            return None
+        path = self._path(instance_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except Exception as exc:
+            logger.warning("[%s] Ignoring unreadable checkpoint %s: %s", instance_id, path, exc)
+            return None
+
+    def save(self, instance_id: str, **fields) -> None:
+        """Merge fields into the instance checkpoint and write it atomically."""
+        if self.checkpoint_dir is None:
+            return
+        data = self.load(instance_id) or {"instance_id": instance_id}
+        data.update(fields)
+        data["updated_at"] = time.time()
+        path = self._path(instance_id)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, path)
+        except Exception as exc:
+            logger.error("[%s] Failed to write checkpoint: %s", instance_id, exc)
+
+    def clear(self, instance_id: str) -> None:
+        """Remove the checkpoint once an instance no longer needs resuming."""
+        if self.checkpoint_dir is None:
+            return
+        try:
+            os.remove(self._path(instance_id))
+        except FileNotFoundError:
+            pass
+
+    def has_session(self, instance_id: str) -> bool:
+        """Whether a resumable agent session is recorded for an instance."""
+        checkpoint = self.load(instance_id)
+        return bool(checkpoint and checkpoint.get("session_id"))
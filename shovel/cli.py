@@ -7,11 +7,33 @@ import asyncio
 import json
 import logging
 import os
+import signal
 import sys
+import time
+from collections.abc import Awaitable, Callable
 from dataclasses import dataclass
 
-from shovel.agent import run_agent
+from shovel.agent import AgentRun, run_agent
+from shovel.batch import RepoBatch, batch_order, plan_batches, remove_checkouts, run_in_batch
+from shovel.cache import DEFAULT_PYPI_UPSTREAM, PackageCache
+from shovel.cascade import CascadeStats, CascadeTier, parse_cascade, static_check_output, summarize_findings
+from shovel.checkpoint import CheckpointStore
+from shovel.hooks import ToolOutputConfig, parse_tool_output_limits
+from shovel.ledger import (
+    CLONE_FAILED,
+    FAILURE_STATUSES,
+    INTERRUPTED,
+    STATIC_CHECK_FAILED,
+    SUCCESS,
+    StatusLedger,
+    default_ledger_path,
+)
+from shovel.metadata import MetadataIndex, apply_where, parse_where, select_instances
+from shovel.progress import AGENT, ProgressTracker, run_progress
+from shovel.speculate import SpeculationConfig, flag_hard_repos, race_attempts
+from shovel.store import ResultStore
 from shovel.utils import clone_repo, load_instances
+from shovel.workspace import Workspace
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +41,7 @@ logger = logging.getLogger(__name__)
 @dataclass
 class RunConfig:
     input: str
-    output: str
+    output: str | None
     repo_dir: str
     model: str
     max_workers: int
@@ -28,9 +50,25 @@ class RunConfig:
     instance_ids: list[str] | None = None
     start: int | None = None
     end: int | None = None
+    where: str | None = None
+    metadata_dir: str = "./metadata"
     log_dir: str | None = "./logs"
     resume: bool = False
-    project_dir: str = "."
+    checkpoint_dir: str | None = "./checkpoints"
+    ledger: str | None = None
+    retry_statuses: list[str] | None = None
+    retry_unvalidated: bool = False
+    tool_output_dir: str | None = "./tool_outputs"
+    tool_output_limits: dict[str, int] | None = None
+    cascade: list[CascadeTier] | None = None
+    speculation: SpeculationConfig | None = None
+    package_cache_dir: str | None = None
+    pypi_upstream: str = DEFAULT_PYPI_UPSTREAM
+    store_dir: str | None = None
+    batch_size: int = 0
+    workspace_root: str | None = None
+    dashboard: bool = False
+    status_file: str | None = None
 
 
 async def process_instance(
@@ -40,36 +78,219 @@ async def process_instance(
     max_turns: int,
     semaphore: asyncio.Semaphore,
     log_dir: str | None = None,
-    project_dir: str = ".",
+    workspace: Workspace | None = None,
+    checkpoints: CheckpointStore | None = None,
+    ledger: StatusLedger | None = None,
+    tool_output: ToolOutputConfig | None = None,
+    cascade: list[CascadeTier] | None = None,
+    cascade_stats: CascadeStats | None = None,
+    speculation: SpeculationConfig | None = None,
+    extra_slots: asyncio.Semaphore | None = None,
+    package_cache: PackageCache | None = None,
+    batch: RepoBatch | None = None,
+    progress: ProgressTracker | None = None,
+    metadata: dict | None = None,
 ) -> tuple[str, dict | None]:
-    """Process one instance: clone repo and run agent."""
+    """Process one instance: clone repo and run agent, recording the outcome in the ledger."""
     instance_id = instance["instance_id"]
     async with semaphore:
-        loop = asyncio.get_running_loop()
-        repo_dir = await loop.run_in_executor(None, clone_repo, instance, repo_root_dir)
+        start_time = time.time()
+        if progress is not None:
+            progress.start(instance_id)
+        try:
+            loop = asyncio.get_running_loop()
+            # Batch members share one checkout, reset to each instance's base commit in turn.
+            checkout_name = batch.checkout_name if batch is not None else None
+            repo_dir = await loop.run_in_executor(
+                None, clone_repo, instance, repo_root_dir, None, "", checkout_name
+            )
+        except asyncio.CancelledError:
+            if ledger is not None:
+                ledger.record(instance_id, INTERRUPTED, duration_s=time.time() - start_time)
+            if progress is not None:
+                progress.finish(instance_id, INTERRUPTED)
+            raise
         if repo_dir is None:
             logger.error("[%s] Failed to clone repo, returning empty result", instance_id)
+            if ledger is not None:
+                ledger.record(instance_id, CLONE_FAILED, duration_s=time.time() - start_time)
+            if progress is not None:
+                progress.finish(instance_id, CLONE_FAILED)
             return instance_id, {"instance_id": instance_id}
+        if progress is not None:
+            progress.update(instance_id, AGENT)
 
-        result = await run_agent(
-            instance,
-            repo_dir,
-            model=model,
-            max_turns=max_turns,
-            log_dir=log_dir,
-            project_dir=project_dir,
-        )
+        # Without a cascade there is a single tier. Speculative (hard) instances go
+        # straight to the strongest tier; others start where a checkpoint left off.
+        tiers = cascade or [CascadeTier(model, max_turns)]
+        first_tier = len(tiers) - 1 if speculation is not None else _first_tier(tiers, instance_id, checkpoints)
+        prior_attempt = None
+        total_cost = 0.0
+        for index in range(first_tier, len(tiers)):
+            tier = tiers[index]
+            final_tier = index == len(tiers) - 1
+            tier_info = {"tier": index + 1} if cascade else {}
+            tier_start = time.time()
+            # Every agent run of this tier, including cancelled ones, for cost accounting.
+            tier_runs: list[AgentRun] = []
+
+            async def run_attempt(attempt: int, attempt_repo_dir: str, hint: str | None) -> AgentRun:
+                models = speculation.models if speculation is not None and speculation.models else None
+                batch_session_id = batch.session_id if batch is not None and tier.model == batch.model else None
+                attempt_run = await run_agent(
+                    instance,
+                    attempt_repo_dir,
+                    model=models[attempt % len(models)] if models else tier.model,
+                    max_turns=tier.max_turns,
+                    log_dir=log_dir,
+                    workspace=workspace,
+                    checkpoints=checkpoints if attempt == 0 else None,
+                    tool_output=tool_output,
+                    max_budget_usd=tier.max_budget_usd,
+                    prior_attempt=prior_attempt,
+                    attempt=attempt,
+                    attempt_hint=hint,
+                    package_cache=package_cache,
+                    batch_session_id=batch_session_id,
+                    progress=progress,
+                    tier=index + 1 if cascade else 0,
+                    final_tier=final_tier,
+                    cancelled_runs=tier_runs,
+                    metadata=metadata,
+                )
+                tier_runs.append(attempt_run)
+                return attempt_run
+
+            try:
+                if speculation is not None and extra_slots is not None:
+                    # Parallel attempts, capped by the run-wide extra_slots; the first validated one wins.
+                    run = await race_attempts(
+                        instance,
+                        repo_dir,
+                        repo_root_dir,
+                        workspace,
+                        speculation,
+                        extra_slots,
+                        run_attempt,
+                        _is_validated,
+                    )
+                    if checkpoints is not None:
+                        checkpoints.clear(instance_id)
+                    tier_info["speculative_attempts"] = len(tier_runs)
+                else:
+                    run = await run_attempt(0, repo_dir, None)
+            except asyncio.CancelledError:
+                if batch is not None:
+                    batch.session_id = None
+                if workspace is not None:
+                    workspace.release(instance_id)
+                cost_usd = _runs_cost(tier_runs)
+                if ledger is not None:
+                    ledger.record(
+                        instance_id,
+                        INTERRUPTED,
+                        duration_s=time.time() - tier_start,
+                        cost_usd=cost_usd,
+                        model=tier.model,
+                        **tier_info,
+                    )
+                if progress is not None:
+                    progress.finish(instance_id, INTERRUPTED, total_cost + (cost_usd or 0.0))
+                raise
+
+            issues = static_check_output(run.output) if run.output is not None and not final_tier else []
+            succeeded = run.status == SUCCESS and not issues
+            cost_usd = _runs_cost(tier_runs)
+            total_cost += cost_usd or 0.0
+            status = run.status if not issues else STATIC_CHECK_FAILED
+            if ledger is not None:
+                ledger.record(
+                    instance_id,
+                    status,
+                    duration_s=time.time() - tier_start,
+                    cost_usd=cost_usd,
+                    num_turns=run.num_turns,
+                    model=run.model or tier.model,
+                    **tier_info,
+                    **_runs_trimming(tier_runs),
+                )
+            if cascade_stats is not None:
+                cascade_stats.record(index, succeeded, cost_usd)
+            if batch is not None and tier.model == batch.model:
+                # Only a session that just produced a working config is worth continuing.
+                batch.session_id = run.session_id if succeeded else None
+            if succeeded or final_tier:
+                break
+            logger.warning(
+                "[%s] Tier %s (%s) failed (%s), escalating to %s",
+                instance_id,
+                index + 1,
+                tier.model,
+                "; ".join(issues) if issues else run.status,
+                tiers[index + 1].model,
+            )
+            prior_attempt = {
+                "model": run.model or tier.model,
+                "status": status,
+                "findings": summarize_findings(run.output, run.last_text, issues),
+            }
+
+        if workspace is not None:
+            workspace.release(instance_id)
+        if progress is not None:
+            progress.finish(instance_id, status, total_cost)
+        result = run.output
         if result is None:
-            logger.warning("[%s] Agent failed or output parse failed, returning empty result", instance_id)
+            logger.warning(
+                "[%s] Agent failed or output parse failed (%s), returning empty result",
+                instance_id,
+                run.status,
+            )
             result = {}
 
         result["instance_id"] = instance_id
         return instance_id, result
 
 
-def _filter_instances(instances: dict[str, dict], cfg: RunConfig) -> dict[str, dict]:
-    """Apply instance id filtering and positional slicing."""
+def _runs_cost(runs: list[AgentRun]) -> float | None:
+    """Total cost of agent runs, None when none of them reported one."""
+    costs = [run.cost_usd for run in runs if run.cost_usd is not None]
+    return sum(costs) if costs else None
+
+
+def _runs_trimming(runs: list[AgentRun]) -> dict[str, int]:
+    """Ledger fields for the tool outputs trimmed across agent runs, if any were."""
+    outputs = sum(run.trimmed_outputs for run in runs)
+    if not outputs:
+        return {}
+    return {"trimmed_outputs": outputs, "trimmed_chars": sum(run.trimmed_chars for run in runs)}
+
+
+def _is_validated(run: AgentRun) -> bool:
+    """Whether a run produced output that parses and passes static checks."""
+    return run.status == SUCCESS and run.output is not None and not static_check_output(run.output)
+
+
+def _first_tier(tiers: list[CascadeTier], instance_id: str, checkpoints: CheckpointStore | None) -> int:
+    """Start at the tier whose interrupted session is checkpointed, so it can be resumed."""
+    checkpoint = checkpoints.load(instance_id) if checkpoints is not None else None
+    if checkpoint and checkpoint.get("session_id"):
+        for index, tier in enumerate(tiers):
+            if tier.model == checkpoint.get("model"):
+                return index
+    return 0
+
+
+def _filter_instances(instances: dict[str, dict], cfg: RunConfig, where: bool = True) -> dict[str, dict]:
+    """Apply the ``--where`` expression, instance id filtering and positional slicing.
+
+    ``where=False`` skips the expression when the instances were already
+    selected with it from the metadata index.
+    """
     selected = instances
+    if cfg.where and where:
+        selected = apply_where(selected, cfg.where)
+        logger.info("Filtered to %s instances matching --where", len(selected))
     if cfg.instance_ids:
         ids = set(cfg.instance_ids)
         selected = {k: v for k, v in selected.items() if k in ids}
@@ -90,9 +311,20 @@ def _filter_instances(instances: dict[str, dict], cfg: RunConfig) -> dict[str, d
     return selected
 
 
-def _load_existing_results(cfg: RunConfig) -> dict[str, dict]:
-    """Load previous output when resume mode is enabled."""
-    if not cfg.resume or not os.path.exists(cfg.output):
+def _load_existing_results(cfg: RunConfig, store: ResultStore | None = None) -> dict[str, dict]:
+    """Load previous output when resume mode is enabled.
+
+    A non-empty result store is preferred over the output file: it loads each
+    unique script once and shares it between results.
+    """
+    if not cfg.resume:
+        return {}
+    if store is not None:
+        existing = store.load_all()
+        if existing:
+            logger.info("Resuming: loaded %s existing results from store %s", len(existing), store.root)
+            return existing
+    if not cfg.output or not os.path.exists(cfg.output):
         return {}
     with open(cfg.output) as f:
         existing = json.load(f)
@@ -100,58 +332,237 @@ def _load_existing_results(cfg: RunConfig) -> dict[str, dict]:
     return existing
 
 
-async def run_pipeline(cfg: RunConfig) -> None:
-    """Run the full generation pipeline."""
-    logger.info("Loading instances from %s", cfg.input)
-    instances = load_instances(cfg.input, split=cfg.split)
-    logger.info("Loaded %s instances", len(instances))
+def _is_failed_result(result: dict) -> bool:
+    """Whether a stored result is the empty placeholder written for a failure."""
+    return "dockerfile" not in result
+
+
+def _select_pending(
+    instances: dict[str, dict],
+    all_results: dict[str, dict],
+    cfg: RunConfig,
+    ledger: StatusLedger,
+    checkpoints: CheckpointStore,
+) -> dict[str, dict]:
+    """Pick the instances a resumed run still has to process.
+
+    - ``--retry-unvalidated``: everything without a successful result.
+    - ``--retry-failed [STATUS ...]``: only instances whose last attempt failed,
+      optionally restricted to the given failure classes.
+    - plain ``--resume``: instances never attempted, plus failed ones whose agent
+      session can be continued from a checkpoint.
+    """
 
-    instances = _filter_instances(instances, cfg)
+    def succeeded(instance_id: str) -> bool:
+        status = ledger.status(instance_id)
+        if status is not None:
+            return status == SUCCESS
+        return instance_id in all_results and not _is_failed_result(all_results[instance_id])
+
+    def failed(instance_id: str) -> bool:
+        status = ledger.status(instance_id)
+        if status is not None:
+            return status != SUCCESS
+        return instance_id in all_results and _is_failed_result(all_results[instance_id])
+
+    if cfg.retry_unvalidated:
+        return {k: v for k, v in instances.items() if not succeeded(k)}
+    if cfg.retry_statuses is not None:
+        if not cfg.retry_statuses:
+            return {k: v for k, v in instances.items() if failed(k)}
+        wanted = set(cfg.retry_statuses)
+        return {k: v for k, v in instances.items() if ledger.status(k) in wanted}
+    return {
+        k: v
+        for k, v in instances.items()
+        if k not in all_results or (failed(k) and checkpoints.has_session(k))
+    }
+
+
+def _install_signal_handlers(tasks: list[asyncio.Task]) -> bool:
+    """Cancel in-flight instances on SIGINT/SIGTERM so they checkpoint before exit.
+
+    Returns False when the platform does not support asyncio signal handlers.
+    """
+    loop = asyncio.get_running_loop()
+
+    def _handle(signum: int) -> None:
+        logger.warning(
+            "Received %s, checkpointing in-flight instances and shutting down (repeat to force)",
+            signal.Signals(signum).name,
+        )
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        for task in tasks:
+            task.cancel()
+
+    try:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, _handle, sig)
+    except (NotImplementedError, RuntimeError):
+        return False
+    return True
+
+
+def _remove_signal_handlers() -> None:
+    """Restore default SIGINT/SIGTERM handling."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.remove_signal_handler(sig)
+
+
+async def run_pipeline(
+    cfg: RunConfig,
+    instances: dict[str, dict] | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+    on_result: Callable[[str, dict, str | None], Awaitable[None]] | None = None,
+    handle_signals: bool = True,
+    package_cache: PackageCache | None = None,
+    preselected: bool = False,
+    index: MetadataIndex | None = None,
+) -> None:
+    """Run the full generation pipeline.
+
+    ``instances``/``index`` reuse the caller's loaded input (``preselected``:
+    already filtered), ``semaphore`` is a shared concurrency budget and
+    ``on_result`` is awaited as ``(instance_id, result, status)`` per instance.
+    """
+    if index is None:
+        index = MetadataIndex(cfg.input, cfg.metadata_dir, cfg.split)
+    where_applied = preselected
+    if instances is None and cfg.where:
+        instances = select_instances(cfg.input, cfg.where, cfg.metadata_dir, split=cfg.split, index=index)
+        where_applied = True
+    elif instances is None:
+        logger.info("Loading instances from %s", cfg.input)
+        instances = load_instances(cfg.input, split=cfg.split)
+        logger.info("Loaded %s instances", len(instances))
+
+    loaded = instances
+    if not preselected:
+        instances = _filter_instances(instances, cfg, where=not where_applied)
     if not instances:
         logger.error("No instances to process")
         return
 
     os.makedirs(cfg.repo_dir, exist_ok=True)
-    all_results = _load_existing_results(cfg)
-    if all_results:
-        instances = {k: v for k, v in instances.items() if k not in all_results}
+    checkpoints = CheckpointStore(cfg.checkpoint_dir)
+    ledger = StatusLedger(cfg.ledger)
+    store = ResultStore(cfg.store_dir) if cfg.store_dir else None
+    all_results = _load_existing_results(cfg, store)
+    if cfg.resume:
+        instances = _select_pending(instances, all_results, cfg, ledger, checkpoints)
         logger.info("Remaining: %s instances to process", len(instances))
+    if not cfg.resume:
+        for instance_id in instances:
+            checkpoints.clear(instance_id)
     if not instances:
         logger.info("All instances already processed")
         return
+    # Precomputed test files and language for the prompts, when the input has been indexed.
+    metadata = index.lookup(instances) if index.built else {}
 
-    semaphore = asyncio.Semaphore(cfg.max_workers)
-    tasks = [
-        asyncio.create_task(
-            process_instance(
-                instance,
-                cfg.repo_dir,
-                cfg.model,
-                cfg.max_turns,
-                semaphore,
-                log_dir=cfg.log_dir,
-                project_dir=cfg.project_dir,
-            )
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(cfg.max_workers)
+    tool_output = None
+    if cfg.tool_output_dir:
+        tool_output = ToolOutputConfig(spill_dir=cfg.tool_output_dir)
+        if cfg.tool_output_limits is not None:
+            tool_output.limits = cfg.tool_output_limits
+    cascade_stats = CascadeStats(cfg.cascade) if cfg.cascade else None
+    hard_repos: set[str] = set()
+    extra_slots = None
+    if cfg.speculation is not None:
+        hard_repos = flag_hard_repos(loaded, ledger, cfg.speculation)
+        extra_slots = asyncio.Semaphore(cfg.speculation.max_extra_attempts)
+    workspace = Workspace(cfg.workspace_root)
+    logger.info("Build workspace: %s", workspace.dir)
+    batches: dict[str, RepoBatch] = {}
+    if cfg.batch_size > 1:
+        batch_model = cfg.cascade[0].model if cfg.cascade else cfg.model
+        batches = plan_batches(
+            instances, cfg.batch_size, batch_model, exclude_repos=hard_repos, run_id=workspace.run_id
+        )
+    owns_cache = package_cache is None and cfg.package_cache_dir is not None
+    if owns_cache:
+        package_cache = PackageCache(cfg.package_cache_dir, pypi_upstream=cfg.pypi_upstream)
+        package_cache.start()
+    progress = ProgressTracker(total=len(instances), max_workers=cfg.max_workers)
+    progress_task = None
+    if cfg.dashboard or cfg.status_file:
+        progress_task = asyncio.create_task(run_progress(progress, live=cfg.dashboard, status_file=cfg.status_file))
+    tasks = []
+    for instance_id in batch_order(instances, batches):
+        instance = instances[instance_id]
+        batch = batches.get(instance_id)
+        work = process_instance(
+            instance,
+            cfg.repo_dir,
+            cfg.model,
+            cfg.max_turns,
+            semaphore,
+            log_dir=cfg.log_dir,
+            workspace=workspace,
+            checkpoints=checkpoints,
+            ledger=ledger,
+            tool_output=tool_output,
+            cascade=cfg.cascade,
+            cascade_stats=cascade_stats,
+            speculation=cfg.speculation if instance["repo"] in hard_repos else None,
+            extra_slots=extra_slots,
+            package_cache=package_cache,
+            batch=batch,
+            progress=progress,
+            metadata=metadata.get(instance_id),
         )
-        for instance in instances.values()
-    ]
+        tasks.append(asyncio.create_task(run_in_batch(batch, work) if batch is not None else work))
+    handlers_installed = handle_signals and _install_signal_handlers(tasks)
 
     completed = 0
-    for coro in asyncio.as_completed(tasks):
-        instance_id, result = await coro
-        if result is not None:
-            all_results[instance_id] = result
-            completed += 1
-            with open(cfg.output, "w") as f:
-                json.dump(all_results, f, indent=2)
-            logger.info(
-                "Progress: %s/%s completed, saved %s to %s",
-                completed,
-                len(tasks),
-                instance_id,
-                cfg.output,
-            )
+    interrupted = 0
+    try:
+        for coro in asyncio.as_completed(tasks):
+            try:
+                instance_id, result = await coro
+            except asyncio.CancelledError:
+                interrupted += 1
+                continue
+            if result is not None:
+                if store is not None:
+                    store.put(instance_id, result)
+                    result = store.get(instance_id)
+                all_results[instance_id] = result
+                completed += 1
+                if cfg.output:
+                    with open(cfg.output, "w") as f:
+                        json.dump(all_results, f, indent=2)
+                logger.info(
+                    "Progress: %s/%s completed, saved %s to %s",
+                    completed,
+                    len(tasks),
+                    instance_id,
+                    cfg.output,
+                )
+                if on_result is not None:
+                    await on_result(instance_id, result, ledger.status(instance_id))
+    finally:
+        for task in tasks:
+            task.cancel()
+        if owns_cache:
+            package_cache.stop()
+        workspace.cleanup()
+        remove_checkouts(batches, cfg.repo_dir)
+        if progress_task is not None:
+            progress_task.cancel()
+            await asyncio.gather(progress_task, return_exceptions=True)
 
+    if handlers_installed:
+        _remove_signal_handlers()
+    if interrupted:
+        logger.warning(
+            "Interrupted: %s instances not finished; rerun with --resume to continue their sessions",
+            interrupted,
+        )
     logger.info("Done! %s results saved to %s", len(all_results), cfg.output)
     omnigril_count = sum(
         1 for val in all_results.values() if "OMNIGRIL_EXIT_CODE" in val.get("eval_script", "")
@@ -166,6 +577,16 @@ async def run_pipeline(cfg: RunConfig) -> None:
         setup_count,
         len(all_results),
     )
+    if cascade_stats is not None:
+        cascade_stats.log_summary()
+    if package_cache is not None:
+        package_cache.log_summary()
+    status_counts = ledger.summary(set(instances))
+    if status_counts:
+        logger.info(
+            "Status: %s",
+            ", ".join(f"{status}={count}" for status, count in sorted(status_counts.items())),
+        )
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -180,34 +601,209 @@ def build_parser() -> argparse.ArgumentParser:
         help="Input dataset path (JSON/JSONL) or HuggingFace dataset name",
     )
     parser.add_argument("--output", default="docker_res.json", help="Output JSON file path")
+    parser.add_argument(
+        "--store",
+        default=None,
+        metavar="DIR",
+        help="Also write results to a content-addressed, sharded result store in DIR",
+    )
     parser.add_argument("--repo-dir", default="./repo", help="Directory for cloning repos")
     parser.add_argument("--model", default="claude-sonnet-4-5-20250929", help="Claude model to use")
     parser.add_argument("--max-workers", type=int, default=4, help="Maximum concurrent agents")
     parser.add_argument("--max-turns", type=int, default=100, help="Maximum agent turns per instance")
+    parser.add_argument(
+        "--cascade",
+        nargs="+",
+        default=None,
+        metavar="MODEL[:TURNS[:BUDGET_USD]]",
+        help=(
+            "Run each instance on these models cheapest first, escalating when a tier fails "
+            "parsing or static checks (overrides --model; TURNS defaults to --max-turns)"
+        ),
+    )
     parser.add_argument("--split", default=None, help="Dataset split (for HuggingFace datasets)")
     parser.add_argument("--instance-ids", nargs="+", default=None, help="Process only specific instance IDs")
     parser.add_argument("--start", type=int, default=None, help="Start index (1-based) of instances to process")
     parser.add_argument("--end", type=int, default=None, help="End index (1-based, inclusive) of instances to process")
+    parser.add_argument(
+        "--where",
+        default=None,
+        metavar="EXPR",
+        help='Process only instances matching a metadata filter, e.g. "repo=rigetti/pyquil and patch_bytes<20000"',
+    )
+    parser.add_argument(
+        "--metadata-dir",
+        default="./metadata",
+        help="Directory for the precomputed instance metadata used by --where",
+    )
     parser.add_argument("--log-dir", default="./logs", help="Directory to save agent trajectory logs")
     parser.add_argument("--resume", action="store_true", help="Resume from existing output file")
+    parser.add_argument(
+        "--retry-failed",
+        nargs="*",
+        choices=FAILURE_STATUSES,
+        default=None,
+        metavar="STATUS",
+        help=(
+            "Resume, retrying only instances whose last attempt failed; optionally "
+            f"restrict to the given statuses ({', '.join(FAILURE_STATUSES)})"
+        ),
+    )
+    parser.add_argument(
+        "--retry-unvalidated",
+        action="store_true",
+        help="Resume, processing every instance that has no successful result",
+    )
+    parser.add_argument(
+        "--ledger",
+        default=None,
+        help="Per-instance status ledger (JSONL); defaults to <output>.status.jsonl",
+    )
+    parser.add_argument(
+        "--speculate",
+        type=int,
+        default=0,
+        metavar="K",
+        help="Race K parallel agent attempts on hard instances (see --speculate-repos/--speculate-below)",
+    )
+    parser.add_argument(
+        "--speculate-repos",
+        nargs="+",
+        default=None,
+        help="Repos whose instances always get speculative attempts",
+    )
+    parser.add_argument(
+        "--speculate-below",
+        type=float,
+        default=None,
+        metavar="RATE",
+        help="Also speculate on repos whose first-attempt success rate in the ledger is below RATE (0-1)",
+    )
+    parser.add_argument(
+        "--speculate-models",
+        nargs="+",
+        default=None,
+        help="Models to rotate across speculative attempts (default: the run's model)",
+    )
+    parser.add_argument(
+        "--max-speculative",
+        type=int,
+        default=2,
+        help="Global cap on extra speculative attempts running at once",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Handle up to N instances of the same repo in one agent session, one after another (0 disables)",
+    )
+    parser.add_argument(
+        "--package-cache",
+        default=None,
+        metavar="DIR",
+        help="Run a local PyPI/apt caching proxy storing packages in DIR and build through it",
+    )
+    parser.add_argument(
+        "--pypi-upstream",
+        default=DEFAULT_PYPI_UPSTREAM,
+        help="Index the package cache mirrors (e.g. a local stand-in index for tests)",
+    )
+    parser.add_argument(
+        "--tool-output-dir",
+        default="./tool_outputs",
+        help="Directory where full tool outputs are saved when trimmed for the agent",
+    )
+    parser.add_argument(
+        "--tool-output-limit",
+        nargs="+",
+        default=None,
+        metavar="TOOL=CHARS",
+        help="Per-tool trim thresholds in characters, e.g. Bash=20000 (0 disables trimming for a tool)",
+    )
+    parser.add_argument(
+        "--no-trim-tool-output",
+        action="store_true",
+        help="Pass tool outputs to the agent untrimmed",
+    )
+    parser.add_argument(
+        "--workspace-root",
+        default=None,
+        help="Root for per-run Docker build dirs (default: /dev/shm/shovel if available, else the temp dir)",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        default="./checkpoints",
+        help="Directory for in-flight agent session checkpoints used by --resume",
+    )
+    parser.add_argument(
+        "--dashboard",
+        action="store_true",
+        help="Show a live status view (worker slots, throughput, cost, ETA); console logs drop to warnings",
+    )
+    parser.add_argument(
+        "--status-file",
+        default=None,
+        help="Keep a JSON snapshot of run progress in this file, refreshed every few seconds",
+    )
     parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose logging")
     return parser
 
 
-def main(argv: list[str] | None = None) -> int:
-    """CLI main function."""
-    parser = build_parser()
-    args = parser.parse_args(list(sys.argv[1:] if argv is None else argv))
-
-    log_level = logging.DEBUG if args.verbose else logging.INFO
+def configure_logging(verbose: bool) -> None:
+    """Configure root logging for CLI entrypoints."""
+    log_level = logging.DEBUG if verbose else logging.INFO
     logging.basicConfig(
         level=log_level,
         format="%(asctime)s %(levelname)s %(name)s: %(message)s",
         datefmt="%H:%M:%S",
     )
 
-    project_dir = os.path.dirname(os.path.abspath(__file__))
-    project_dir = os.path.dirname(project_dir)
+
+def main(argv: list[str] | None = None) -> int:
+    """CLI main function."""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] in (["serve"], ["submit"]):
+        from shovel import server
+
+        return server.main(argv)
+    if argv[:1] == ["store"]:
+        from shovel import store
+
+        return store.main(argv[1:])
+    if argv[:1] == ["metadata"]:
+        from shovel import metadata
+
+        return metadata.main(argv[1:])
+    if argv[:1] == ["replay"]:
+        from shovel import replay
+
+        return replay.main(argv[1:])
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    configure_logging(args.verbose)
+    if args.dashboard and sys.stderr.isatty():
+        # Keep the redrawn view readable; full detail stays in the trajectory logs.
+        for handler in logging.getLogger().handlers:
+            handler.setLevel(logging.WARNING)
+    try:
+        tool_output_limits = parse_tool_output_limits(args.tool_output_limit)
+        cascade = parse_cascade(args.cascade, args.max_turns) if args.cascade else None
+        if args.where:
+            parse_where(args.where)
+    except ValueError as exc:
+        parser.error(str(exc))
+    speculation = None
+    if args.speculate > 1:
+        speculation = SpeculationConfig(
+            attempts=args.speculate,
+            repos=set(args.speculate_repos or []),
+            below_success_rate=args.speculate_below,
+            models=args.speculate_models,
+            max_extra_attempts=args.max_speculative,
+        )
+
     cfg = RunConfig(
         input=args.input,
         output=args.output,
@@ -219,9 +815,25 @@ def main(argv: list[str] | None = None) -> int:
         instance_ids=args.instance_ids,
         start=args.start,
         end=args.end,
+        where=args.where,
+        metadata_dir=args.metadata_dir,
         log_dir=args.log_dir,
-        resume=args.resume,
-        project_dir=project_dir,
+        resume=args.resume or args.retry_failed is not None or args.retry_unvalidated,
+        checkpoint_dir=args.checkpoint_dir,
+        ledger=args.ledger or default_ledger_path(args.output),
+        retry_statuses=args.retry_failed,
+        retry_unvalidated=args.retry_unvalidated,
+        tool_output_dir=None if args.no_trim_tool_output else args.tool_output_dir,
+        tool_output_limits=tool_output_limits,
+        cascade=cascade,
+        speculation=speculation,
+        package_cache_dir=args.package_cache,
+        pypi_upstream=args.pypi_upstream,
+        store_dir=args.store,
+        batch_size=args.batch_size,
+        workspace_root=args.workspace_root,
+        dashboard=args.dashboard,
+        status_file=args.status_file,
     )
 
     asyncio.run(run_pipeline(cfg))
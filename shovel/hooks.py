@@ -0,0 +1,317 @@
+"""Agent SDK hooks that keep long tool outputs out of the model context."""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import shlex
+import sys
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# Per-tool character thresholds above which output is trimmed. Read is left
+# alone on purpose: it is how the agent gets at the saved full output.
+DEFAULT_TOOL_OUTPUT_LIMITS = {
+    "Bash": 8000,
+    "BashOutput": 8000,
+    "Grep": 12000,
+    "WebFetch": 20000,
+}
+
+# Response fields that hold free-form text in built-in tool outputs.
+TEXT_FIELDS = ("stdout", "stderr", "content", "output", "result")
+
+ERROR_PATTERN = "error|fail|exception|traceback|fatal|not found|denied|cannot|unable"
+ERROR_LINE_RE = re.compile(ERROR_PATTERN, re.IGNORECASE)
+
+# Note appended to every trimmed output; tool results are scanned for it to
+# count the trims that actually reached the model.
+TRIM_NOTE = "[shovel: output trimmed from {size} chars; full output saved to {path} - use Read to view it]"
+TRIM_NOTE_RE = re.compile(r"\[shovel: output trimmed from (\d+) chars")
+
+# Printed by a Bash command as soon as its output goes over the limit, so the
+# saved copy can be found even if the tool call times out before the end.
+SPILL_NOTE = "[shovel: output is long; the rest is trimmed and the full output saved to {path}]"
+
+# Bash commands run with their output piped through this module's
+# stream_trimmed. The command itself runs in the current shell so ``cd`` and
+# exported variables stay in effect, and an EXIT trap drains the filter when
+# the command calls ``exit`` or fails under ``set -e``.
+BASH_WRAPPER = """\
+exec 3>&1 4>&2 > >({filter}) 2>&1
+__shovel_filter=$!
+__shovel_drain() {{ exec 1>&3 2>&4 3>&- 4>&-; wait "$__shovel_filter" 2>/dev/null; }}
+trap __shovel_drain EXIT
+{command}
+__shovel_rc=$?
+trap - EXIT
+__shovel_drain
+(exit $__shovel_rc)"""
+
+
+@dataclass
+class ToolOutputConfig:
+    """Where full outputs are saved and how much of each tool's output is kept."""
+
+    spill_dir: str = "./tool_outputs"
+    limits: dict[str, int] = field(default_factory=lambda: dict(DEFAULT_TOOL_OUTPUT_LIMITS))
+    head_lines: int = 60
+    tail_lines: int = 60
+    max_error_lines: int = 40
+
+
+@dataclass
+class ToolOutputStats:
+    """Trims seen in the tool results the model received, as chars removed per output."""
+
+    trims: list[int] = field(default_factory=list)
+
+    @property
+    def trimmed_chars(self) -> int:
+        return sum(self.trims)
+
+    def observe(self, content: Any) -> None:
+        """Record a tool result if it carries a trim note."""
+        if isinstance(content, list):
+            text = "".join(str(item.get("text", "")) for item in content if isinstance(item, dict))
+        else:
+            text = str(content or "")
+        for match in TRIM_NOTE_RE.finditer(text):
+            self.trims.append(max(int(match.group(1)) - len(text), 0))
+
+
+def _clip_chars(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n...\n{text[-half:]}"
+
+
+def trim_text(text: str, cfg: ToolOutputConfig, limit: int, spill_path: str) -> str:
+    """Keep head, tail and error lines of a long output, pointing at the saved full copy."""
+    lines = text.splitlines()
+    kept = text
+    if len(lines) > cfg.head_lines + cfg.tail_lines:
+        middle = lines[cfg.head_lines : len(lines) - cfg.tail_lines]
+        errors = [line for line in middle if ERROR_LINE_RE.search(line)][: cfg.max_error_lines]
+        parts = lines[: cfg.head_lines]
+        parts.append(f"... [{len(middle)} lines omitted] ...")
+        if errors:
+            parts.append(f"... [{len(errors)} error lines from the omitted part] ...")
+            parts.extend(errors)
+            parts.append("...")
+        parts.extend(lines[len(lines) - cfg.tail_lines :])
+        kept = "\n".join(parts)
+    kept = _clip_chars(kept, limit)
+    return f"{kept}\n{TRIM_NOTE.format(size=len(text), path=spill_path)}"
+
+
+def stream_trimmed(
+    lines: Iterable[str], write: Callable[[str], Any], cfg: ToolOutputConfig, limit: int, spill_path: str
+) -> None:
+    """Pass output through as it arrives, trimming it like trim_text once it goes over ``limit``.
+
+    The head is written straight away; the full output is only saved to
+    ``spill_path`` when it turns out to be too long.
+    """
+    head: list[str] = []
+    pending: list[str] = []
+    tail: deque[str] = deque()
+    errors: list[str] = []
+    omitted = 0
+    total = 0
+    spill = None
+
+    def push(line: str) -> None:
+        nonlocal omitted
+        tail.append(line)
+        if len(tail) > cfg.tail_lines:
+            line = tail.popleft()
+            omitted += 1
+            if len(errors) < cfg.max_error_lines and ERROR_LINE_RE.search(line):
+                errors.append(line.rstrip("\n") + "\n")
+
+    for line in lines:
+        total += len(line)
+        if spill is not None:
+            spill.write(line)
+            push(line)
+        elif not pending and len(head) < cfg.head_lines and total <= limit // 2:
+            head.append(line)
+            write(line)
+        else:
+            pending.append(line)
+            if total > limit:
+                spill = open(spill_path, "w", buffering=1)
+                spill.writelines(head + pending)
+                write(SPILL_NOTE.format(path=spill_path) + "\n")
+                for kept in pending:
+                    push(kept)
+                head, pending = [], []
+
+    if spill is None:
+        write("".join(pending))
+        return
+    spill.close()
+    parts = [f"... [{omitted} lines omitted] ...\n"]
+    if errors:
+        parts.append(f"... [{len(errors)} error lines from the omitted part] ...\n")
+        parts.extend(errors)
+        parts.append("...\n")
+    kept = "".join(tail)
+    if len(kept) > limit // 2:
+        kept = "...\n" + kept[-(limit // 2) :]
+    if kept and not kept.endswith("\n"):
+        kept += "\n"
+    parts.append(kept)
+    parts.append(TRIM_NOTE.format(size=total, path=spill_path) + "\n")
+    write("".join(parts))
+
+
+def wrap_bash_command(command: str, cfg: ToolOutputConfig, limit: int, spill_path: str) -> str:
+    """Shell command that runs ``command`` and prints a trimmed view of long output."""
+    args = [
+        sys.executable,
+        os.path.abspath(__file__),
+        spill_path,
+        limit,
+        cfg.head_lines,
+        cfg.tail_lines,
+        cfg.max_error_lines,
+    ]
+    return BASH_WRAPPER.format(command=command, filter=" ".join(shlex.quote(str(arg)) for arg in args))
+
+
+def _spill_dir(instance_id: str, cfg: ToolOutputConfig) -> str:
+    return os.path.join(os.path.abspath(cfg.spill_dir), instance_id.replace("/", "__"))
+
+
+def make_bash_input_hook(instance_id: str, cfg: ToolOutputConfig):
+    """Build a PreToolUse hook that makes Bash commands save long output and print a trimmed view.
+
+    Rewriting the command is used for Bash rather than replacing its result:
+    the trimmed view is produced by the command itself, whatever the SDK does
+    with hook output.
+    """
+    spill_dir = _spill_dir(instance_id, cfg)
+    limit = cfg.limits.get("Bash")
+
+    async def hook(input_data: dict[str, Any], tool_use_id: str | None, context: Any) -> dict[str, Any]:
+        tool_input = input_data.get("tool_input") or {}
+        command = tool_input.get("command")
+        # Background commands are read through BashOutput, which has its own limit.
+        if not limit or not command or tool_input.get("run_in_background"):
+            return {}
+        try:
+            os.makedirs(spill_dir, exist_ok=True)
+        except OSError as exc:
+            logger.warning("[%s] Could not create %s, leaving Bash output untrimmed: %s", instance_id, spill_dir, exc)
+            return {}
+        use_id = tool_use_id or input_data.get("tool_use_id") or "unknown"
+        spill_path = os.path.join(spill_dir, f"{use_id}.txt")
+        return {
+            "hookSpecificOutput": {
+                "hookEventName": "PreToolUse",
+                "permissionDecision": "allow",
+                "updatedInput": {**tool_input, "command": wrap_bash_command(command, cfg, limit, spill_path)},
+            }
+        }
+
+    return hook
+
+
+def make_tool_output_hook(instance_id: str, cfg: ToolOutputConfig):
+    """Build a PostToolUse hook that trims oversized tool results before the model sees them.
+
+    The replacement keeps the shape of the tool's response, since the SDK
+    rejects an ``updatedToolOutput`` that does not match the tool's output
+    schema and keeps the original output instead.
+    """
+    spill_dir = _spill_dir(instance_id, cfg)
+
+    def _spill(tool_use_id: str, suffix: str, text: str) -> str:
+        os.makedirs(spill_dir, exist_ok=True)
+        path = os.path.join(spill_dir, f"{tool_use_id}{suffix}.txt")
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def _trim(tool_name: str, tool_use_id: str, suffix: str, text: str) -> str | None:
+        limit = cfg.limits.get(tool_name)
+        if not limit or len(text) <= limit:
+            return None
+        try:
+            path = _spill(tool_use_id, suffix, text)
+        except Exception as exc:
+            logger.warning(
+                "[%s] Could not save full %s output, leaving it untrimmed: %s",
+                instance_id,
+                tool_name,
+                exc,
+            )
+            return None
+        logger.debug("[%s] Trimming %s output of %s chars (%s)", instance_id, tool_name, len(text), path)
+        return trim_text(text, cfg, limit, path)
+
+    async def hook(input_data: dict[str, Any], tool_use_id: str | None, context: Any) -> dict[str, Any]:
+        tool_name = input_data.get("tool_name", "")
+        response = input_data.get("tool_response")
+        use_id = tool_use_id or input_data.get("tool_use_id") or "unknown"
+
+        updated: Any = None
+        if isinstance(response, str):
+            updated = _trim(tool_name, use_id, "", response)
+        elif isinstance(response, dict):
+            changed = {}
+            for key in TEXT_FIELDS:
+                value = response.get(key)
+                if isinstance(value, str):
+                    trimmed = _trim(tool_name, use_id, f".{key}", value)
+                    if trimmed is not None:
+                        changed[key] = trimmed
+            if changed:
+                updated = {**response, **changed}
+
+        if updated is None:
+            return {}
+        return {
+            "hookSpecificOutput": {
+                "hookEventName": "PostToolUse",
+                "updatedToolOutput": updated,
+            }
+        }
+
+    return hook
+
+
+def parse_tool_output_limits(specs: list[str] | None) -> dict[str, int]:
+    """Parse ``Tool=CHARS`` overrides on top of the default limits (0 disables a tool)."""
+    limits = dict(DEFAULT_TOOL_OUTPUT_LIMITS)
+    for spec in specs or []:
+        tool, sep, value = spec.partition("=")
+        if not sep or not value.isdigit():
+            raise ValueError(f"Invalid tool output limit {spec!r}, expected Tool=CHARS")
+        limits[tool] = int(value)
+    return limits
+
+
+def main(argv: list[str]) -> int:
+    """Filter stdin for a wrapped Bash command: ``SPILL LIMIT HEAD TAIL MAX_ERRORS``."""
+    spill_path, limit, head_lines, tail_lines, max_error_lines = argv
+    cfg = ToolOutputConfig(head_lines=int(head_lines), tail_lines=int(tail_lines), max_error_lines=int(max_error_lines))
+    lines = (line.decode(errors="replace") for line in sys.stdin.buffer)
+
+    def write(text: str) -> None:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    stream_trimmed(lines, write, cfg, int(limit), spill_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+"""Per-instance status ledger: outcome, attempts, durations and cost."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+SUCCESS = "success"
+CLONE_FAILED = "clone_failed"
+AGENT_ERROR = "agent_error"
+PARSE_FAILED = "parse_failed"
+BUDGET_EXCEEDED = "budget_exceeded"
+STATIC_CHECK_FAILED = "static_check_failed"
+INTERRUPTED = "interrupted"
+
+FAILURE_STATUSES = (CLONE_FAILED, AGENT_ERROR, PARSE_FAILED, BUDGET_EXCEEDED, STATIC_CHECK_FAILED, INTERRUPTED)
+
+
+def default_ledger_path(output: str) -> str:
+    """Ledger path that sits next to an output file."""
+    root, _ = os.path.splitext(output)
+    return f"{root}.status.jsonl"
+
+
+class StatusLedger:
+    """Append-only JSONL log of instance attempts, folded into one entry per instance.
+
+    Each line records one attempt. Reading the file back gives, per instance, the
+    latest status plus the attempt count and accumulated duration and cost.
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path) as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except Exception:
+                    logger.warning("Skipping malformed ledger line %s in %s", line_no, self.path)
+                    continue
+                self._fold(record)
+        logger.info("Loaded status ledger for %s instances from %s", len(self.entries), self.path)
+
+    def _fold(self, record: dict) -> dict:
+        instance_id = record["instance_id"]
+        entry = self.entries.setdefault(
+            instance_id,
+            {
+                "instance_id": instance_id,
+                "status": None,
+                "attempts": 0,
+                "total_duration_s": 0.0,
+                "total_cost_usd": 0.0,
+            },
+        )
+        entry["status"] = record["status"]
+        entry["attempts"] += 1
+        if entry["attempts"] == 1:
+            entry["first_status"] = record["status"]
+        entry["total_duration_s"] = round(entry["total_duration_s"] + (record.get("duration_s") or 0.0), 2)
+        entry["total_cost_usd"] = round(entry["total_cost_usd"] + (record.get("cost_usd") or 0.0), 6)
+        entry["last_attempt"] = record
+        return entry
+
+    def record(
+        self,
+        instance_id: str,
+        status: str,
+        duration_s: float | None = None,
+        cost_usd: float | None = None,
+        num_turns: int | None = None,
+        **extra,
+    ) -> dict:
+        """Record one finished attempt and return the updated instance entry."""
+        record = {
+            "instance_id": instance_id,
+            "status": status,
+            "finished_at": time.time(),
+            "duration_s": round(duration_s, 2) if duration_s is not None else None,
+            "cost_usd": cost_usd,
+            "num_turns": num_turns,
+            **extra,
+        }
+        entry = self._fold(record)
+        if self.path is not None:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except Exception as exc:
+                logger.error("[%s] Failed to append to status ledger: %s", instance_id, exc)
+        return entry
+
+    def status(self, instance_id: str) -> str | None:
+        """Latest recorded status for an instance, or None if never attempted."""
+        entry = self.entries.get(instance_id)
+        return entry["status"] if entry else None
+
+    def summary(self, instance_ids=None) -> dict[str, int]:
+        """Count instances per latest status."""
+        counts: dict[str, int] = {}
+        for instance_id, entry in self.entries.items():
+            if instance_ids is not None and instance_id not in instance_ids:
+                continue
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
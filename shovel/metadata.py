@@ -0,0 +1,337 @@
+"""Per-instance metadata, precomputed once per input and filtered column-wise.
+
+Selecting work from a large dataset used to mean loading and parsing every
+instance. ``MetadataIndex`` scans the input once, in parallel across cores,
+and computes for each instance its repo, language, test files, patch sizes,
+``created_at`` and (for JSONL inputs) the byte offset of its line. Each column
+goes into its own JSON file under a directory keyed by a hash of the input's
+path, size and mtime::
+
+    <cache_dir>/<key>/meta.json          input path, row count, column names
+    <cache_dir>/<key>/<column>.json      one list per column, in input order
+
+A ``--where`` expression only reads the columns it mentions. For JSONL inputs
+only the matching lines are then parsed, found by seeking to their offsets.
+
+Expressions are ``and``-joined clauses of ``field op value``:
+
+- ``=`` / ``==`` / ``!=``: equality. ``=`` also takes a comma-separated list.
+- ``<`` / ``<=`` / ``>`` / ``>=``: numeric or string comparison.
+- ``~``: glob match (``fnmatch``); on ``test_files``, matches if any file does.
+
+For example: ``repo=rigetti/pyquil and patch_bytes<20000 and created_at>=2020``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from shovel.utils import detect_language, get_modified_files, load_instances
+
+logger = logging.getLogger(__name__)
+
+# Columns stored per instance; ``offset`` is -1 for non-JSONL inputs.
+COLUMNS = (
+    "instance_id",
+    "repo",
+    "language",
+    "created_at",
+    "patch_bytes",
+    "test_patch_bytes",
+    "num_test_files",
+    "test_files",
+    "offset",
+)
+
+NUMERIC_COLUMNS = ("patch_bytes", "test_patch_bytes", "num_test_files", "offset")
+
+CLAUSE_RE = re.compile(r"^\s*([A-Za-z_]+)\s*(==|!=|<=|>=|=|<|>|~)\s*(.*?)\s*$")
+
+# Byte ranges per worker process when scanning a JSONL input.
+RANGES_PER_WORKER = 4
+
+
+def compute_metadata(instance: dict, offset: int = -1) -> dict:
+    """Metadata row for one instance."""
+    test_patch = instance.get("test_patch") or ""
+    patch = instance.get("patch") or ""
+    test_files = get_modified_files(test_patch)
+    return {
+        "instance_id": instance["instance_id"],
+        "repo": instance.get("repo") or "",
+        "language": detect_language(test_files),
+        "created_at": str(instance.get("created_at") or ""),
+        "patch_bytes": len(patch.encode()),
+        "test_patch_bytes": len(test_patch.encode()),
+        "num_test_files": len(test_files),
+        "test_files": test_files,
+        "offset": offset,
+    }
+
+
+def _scan_range(path: str, start: int, end: int) -> list[dict]:
+    """Metadata rows for the JSONL lines that start within ``[start, end)``."""
+    rows = []
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            # Skip the line in progress unless ``start`` is exactly at a line start.
+            f.readline()
+        while True:
+            offset = f.tell()
+            if offset >= end:
+                break
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                rows.append(compute_metadata(json.loads(line), offset))
+    return rows
+
+
+def _compute_rows(input_path: str, split: str | None, workers: int | None) -> list[dict]:
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if input_path.endswith(".jsonl"):
+            size = os.path.getsize(input_path)
+            step = max(1, -(-size // (workers * RANGES_PER_WORKER)))
+            starts = list(range(0, size, step))
+            chunks = pool.map(_scan_range, [input_path] * len(starts), starts, [s + step for s in starts])
+            return [row for chunk in chunks for row in chunk]
+        instances = list(load_instances(input_path, split=split).values())
+        chunksize = max(1, len(instances) // (workers * RANGES_PER_WORKER))
+        return list(pool.map(compute_metadata, instances, chunksize=chunksize))
+
+
+def parse_where(expr: str) -> list[tuple[str, str, object]]:
+    """Parse a ``--where`` expression into ``(column, op, value)`` clauses."""
+    clauses = []
+    for part in re.split(r"\s+and\s+", expr.strip(), flags=re.IGNORECASE):
+        match = CLAUSE_RE.match(part)
+        if not match:
+            raise ValueError(f"Invalid --where clause {part!r}, expected FIELD OP VALUE")
+        column, op, raw = match.groups()
+        if column not in COLUMNS:
+            raise ValueError(f"Unknown --where field {column!r}; known fields: {', '.join(COLUMNS)}")
+        raw = raw.strip("'\"")
+        if op == "=" and "," in raw:
+            values = [v.strip() for v in raw.split(",")]
+            value: object = {int(v) for v in values} if column in NUMERIC_COLUMNS else set(values)
+            op = "in"
+        elif column in NUMERIC_COLUMNS and op != "~":
+            try:
+                value = int(raw)
+            except ValueError:
+                raise ValueError(f"--where field {column!r} needs an integer, got {raw!r}") from None
+        else:
+            value = raw
+        clauses.append((column, "==" if op == "=" else op, value))
+    return clauses
+
+
+def _predicate(column: str, op: str, value):
+    if column == "test_files":
+        if op == "~":
+            return lambda files: any(fnmatch.fnmatchcase(f, value) for f in files)
+        if op in ("==", "in"):
+            wanted = value if op == "in" else {value}
+            return lambda files: any(f in wanted for f in files)
+        if op == "!=":
+            return lambda files: value not in files
+        raise ValueError(f"Operator {op!r} is not supported on test_files")
+    if op == "~":
+        return lambda v: fnmatch.fnmatchcase(str(v), value)
+    if op == "in":
+        return value.__contains__
+    return {
+        "==": lambda v: v == value,
+        "!=": lambda v: v != value,
+        "<": lambda v: v < value,
+        "<=": lambda v: v <= value,
+        ">": lambda v: v > value,
+        ">=": lambda v: v >= value,
+    }[op]
+
+
+def filter_rows(columns: dict[str, list], clauses: list[tuple[str, str, object]]) -> list[int]:
+    """Row indices matching every clause, evaluated one column at a time."""
+    count = len(next(iter(columns.values()))) if columns else 0
+    selected = range(count)
+    for column, op, value in clauses:
+        test = _predicate(column, op, value)
+        data = columns[column]
+        selected = [i for i in selected if test(data[i])]
+    return list(selected)
+
+
+def apply_where(instances: dict[str, dict], expr: str) -> dict[str, dict]:
+    """Filter already loaded instances by a ``--where`` expression."""
+    clauses = parse_where(expr)
+    rows = [compute_metadata(instance) for instance in instances.values()]
+    columns = {column: [row[column] for row in rows] for column, _, _ in clauses}
+    ids = [rows[i]["instance_id"] for i in filter_rows(columns, clauses)]
+    return {instance_id: instances[instance_id] for instance_id in ids}
+
+
+class MetadataIndex:
+    """Column-per-file metadata cache for one input dataset."""
+
+    def __init__(self, input_path: str, cache_dir: str, split: str | None = None):
+        self.input_path = input_path
+        self.split = split
+        self.dir = os.path.join(cache_dir, self.cache_key(input_path, split))
+        self._columns: dict[str, list] = {}
+
+    @staticmethod
+    def cache_key(input_path: str, split: str | None = None) -> str:
+        """Hash of the input's identity; changes whenever the file is rewritten."""
+        if os.path.exists(input_path):
+            stat = os.stat(input_path)
+            identity = f"{os.path.abspath(input_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        else:
+            identity = f"{input_path}|{split}"
+        return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+    @property
+    def built(self) -> bool:
+        return os.path.exists(os.path.join(self.dir, "meta.json"))
+
+    def build(self, workers: int | None = None) -> int:
+        """Scan the input and write every column; returns the row count."""
+        start = time.perf_counter()
+        rows = _compute_rows(self.input_path, self.split, workers)
+        os.makedirs(self.dir, exist_ok=True)
+        for column in COLUMNS:
+            values = [row[column] for row in rows]
+            tmp_path = os.path.join(self.dir, f"{column}.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(values, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.dir, f"{column}.json"))
+        # meta.json is written last, so a half-built index is never used.
+        with open(os.path.join(self.dir, "meta.json"), "w") as f:
+            json.dump({"input": self.input_path, "split": self.split, "rows": len(rows), "columns": COLUMNS}, f)
+        logger.info(
+            "Built metadata for %s instances from %s in %.1fs (%s)",
+            len(rows),
+            self.input_path,
+            time.perf_counter() - start,
+            self.dir,
+        )
+        return len(rows)
+
+    def ensure_built(self, workers: int | None = None) -> None:
+        if not self.built:
+            self.build(workers)
+
+    def column(self, name: str) -> list:
+        """Load one column, reading its file on first use."""
+        if name not in self._columns:
+            with open(os.path.join(self.dir, f"{name}.json")) as f:
+                self._columns[name] = json.load(f)
+        return self._columns[name]
+
+    def where(self, expr: str) -> list[int]:
+        """Row indices matching a ``--where`` expression."""
+        clauses = parse_where(expr)
+        return filter_rows({column: self.column(column) for column, _, _ in clauses}, clauses)
+
+    def lookup(self, instance_ids, columns: tuple[str, ...] = ("test_files", "language")) -> dict[str, dict]:
+        """Metadata of the given instances by id; ids not in the index are left out."""
+        wanted = set(instance_ids)
+        values = {column: self.column(column) for column in columns}
+        return {
+            instance_id: {column: values[column][row] for column in columns}
+            for row, instance_id in enumerate(self.column("instance_id"))
+            if instance_id in wanted
+        }
+
+    def load(self, rows: list[int]) -> dict[str, dict]:
+        """Instances for the given rows, in input order.
+
+        JSONL inputs are read by seeking to each row's offset; other inputs are
+        loaded in full and then narrowed down.
+        """
+        offsets = self.column("offset")
+        if self.input_path.endswith(".jsonl"):
+            instances = {}
+            with open(self.input_path, "rb") as f:
+                for row in rows:
+                    f.seek(offsets[row])
+                    item = json.loads(f.readline())
+                    instances[item["instance_id"]] = item
+            return instances
+        ids = self.column("instance_id")
+        loaded = load_instances(self.input_path, split=self.split)
+        return {ids[row]: loaded[ids[row]] for row in rows}
+
+
+def select_instances(
+    input_path: str,
+    expr: str,
+    cache_dir: str,
+    split: str | None = None,
+    workers: int | None = None,
+    index: MetadataIndex | None = None,
+) -> dict[str, dict]:
+    """Load only the instances matching ``expr``, building the index if needed."""
+    index = index or MetadataIndex(input_path, cache_dir, split)
+    index.ensure_built(workers)
+    start = time.perf_counter()
+    rows = index.where(expr)
+    instances = index.load(rows)
+    logger.info(
+        "Selected %s instances with --where %r in %.3fs",
+        len(instances),
+        expr,
+        time.perf_counter() - start,
+    )
+    return instances
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the parser for ``shovel metadata``."""
+    parser = argparse.ArgumentParser(
+        prog="shovel metadata",
+        description="Precompute instance metadata for an input and query it with --where",
+    )
+    parser.add_argument("--input", required=True, help="Input dataset path (JSON/JSONL) or HuggingFace dataset name")
+    parser.add_argument("--split", default=None, help="Dataset split (for HuggingFace datasets)")
+    parser.add_argument("--metadata-dir", default="./metadata", help="Directory for cached metadata columns")
+    parser.add_argument(
+        "--where",
+        default=None,
+        help='Filter expression, e.g. "repo=rigetti/pyquil and patch_bytes<20000"',
+    )
+    parser.add_argument("--rebuild", action="store_true", help="Recompute metadata even if it is cached")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    return parser
+
+
+def main(argv: list[str]) -> int:
+    """Entry point for ``shovel metadata``: build the cache and print matching ids."""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    index = MetadataIndex(args.input, args.metadata_dir, args.split)
+    if args.rebuild or not index.built:
+        index.build(args.workers)
+    if args.where:
+        start = time.perf_counter()
+        try:
+            rows = index.where(args.where)
+        except ValueError as exc:
+            logger.error("%s", exc)
+            return 2
+        ids = index.column("instance_id")
+        for row in rows:
+            sys.stdout.write(ids[row] + "\n")
+        logger.info("%s instances match (%.3fs)", len(rows), time.perf_counter() - start)
+    return 0
@@ -0,0 +1,215 @@
+"""Live run progress: worker slots, throughput, cost and ETA.
+
+``ProgressTracker`` is updated by ``process_instance`` and ``run_agent`` as
+instances move through their phases. ``run_progress`` refreshes it
+periodically: it redraws a status view on the terminal and/or atomically
+rewrites a JSON status file that other tools can poll.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+
+from shovel.ledger import SUCCESS
+
+CLONING = "cloning"
+AGENT = "agent"
+BUILDING = "building"
+VALIDATING = "validating"
+
+# Finished instances averaged for the ETA; recent ones reflect the current mix best.
+ETA_WINDOW = 50
+
+# Refreshes between snapshots when the view goes to a file or pipe.
+APPEND_EVERY = 15
+
+
+def phase_for_tool(tool_name: str, tool_input: dict) -> str:
+    """Phase implied by a tool call: Docker builds and runs stand out from other turns."""
+    if tool_name == "Bash":
+        command = tool_input.get("command", "")
+        if "docker build" in command:
+            return BUILDING
+        if "docker run" in command:
+            return VALIDATING
+    return AGENT
+
+
+def _format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+@dataclass
+class _Slot:
+    instance_id: str
+    started_at: float
+    phase: str = CLONING
+    phase_started_at: float = 0.0
+    turn: int = 0
+
+
+@dataclass
+class ProgressTracker:
+    """Per-slot state and running totals for one pipeline run."""
+
+    total: int
+    max_workers: int
+    started_at: float = field(default_factory=time.time)
+    slots: list[_Slot | None] = field(default_factory=list)
+    statuses: dict[str, int] = field(default_factory=dict)
+    durations: list[float] = field(default_factory=list)
+    cost_usd: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.slots = [None] * self.max_workers
+
+    def _find(self, instance_id: str) -> _Slot | None:
+        return next((slot for slot in self.slots if slot is not None and slot.instance_id == instance_id), None)
+
+    def start(self, instance_id: str) -> None:
+        """Put an instance into the first free worker slot."""
+        now = time.time()
+        slot = _Slot(instance_id, now, phase_started_at=now)
+        for index, current in enumerate(self.slots):
+            if current is None:
+                self.slots[index] = slot
+                return
+        # More instances than slots (e.g. a semaphore shared with other jobs).
+        self.slots.append(slot)
+
+    def update(self, instance_id: str, phase: str, turn: int | None = None) -> None:
+        """Record an instance's current phase and agent turn."""
+        slot = self._find(instance_id)
+        if slot is None:
+            return
+        if phase != slot.phase:
+            slot.phase = phase
+            slot.phase_started_at = time.time()
+        if turn is not None:
+            slot.turn = turn
+
+    def finish(self, instance_id: str, status: str, cost_usd: float | None = None) -> None:
+        """Free an instance's slot and count its outcome."""
+        slot = self._find(instance_id)
+        if slot is not None:
+            self.durations.append(time.time() - slot.started_at)
+            self.slots[self.slots.index(slot)] = None
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.cost_usd += cost_usd or 0.0
+
+    def snapshot(self) -> dict:
+        """Current state as a JSON-friendly dict."""
+        now = time.time()
+        elapsed = now - self.started_at
+        finished = sum(self.statuses.values())
+        active = [slot for slot in self.slots if slot is not None]
+        queued = max(self.total - finished - len(active), 0)
+
+        recent = self.durations[-ETA_WINDOW:]
+        avg_duration = sum(recent) / len(recent) if recent else None
+        eta_s = None
+        if avg_duration is not None:
+            in_flight = sum(max(avg_duration - (now - slot.started_at), 0.0) for slot in active)
+            eta_s = (queued * avg_duration + in_flight) / max(self.max_workers, 1)
+
+        return {
+            "updated_at": now,
+            "elapsed_s": round(elapsed, 1),
+            "total": self.total,
+            "finished": finished,
+            "succeeded": self.statuses.get(SUCCESS, 0),
+            "active": len(active),
+            "queued": queued,
+            "statuses": dict(self.statuses),
+            "instances_per_hour": round(finished / elapsed * 3600, 2) if elapsed > 0 else 0.0,
+            "cost_usd": round(self.cost_usd, 4),
+            "avg_duration_s": round(avg_duration, 1) if avg_duration is not None else None,
+            "eta_s": round(eta_s) if eta_s is not None else None,
+            "slots": [
+                {
+                    "slot": index + 1,
+                    "instance_id": slot.instance_id,
+                    "phase": slot.phase,
+                    "turn": slot.turn,
+                    "elapsed_s": round(now - slot.started_at, 1),
+                    "phase_elapsed_s": round(now - slot.phase_started_at, 1),
+                }
+                if slot is not None
+                else {"slot": index + 1, "instance_id": None}
+                for index, slot in enumerate(self.slots)
+            ],
+        }
+
+    def render(self, snapshot: dict | None = None) -> str:
+        """Plain-text status view."""
+        snap = snapshot or self.snapshot()
+        finished = snap["finished"]
+        cost_per = f" (${snap['cost_usd'] / finished:.2f}/instance)" if finished and snap["cost_usd"] else ""
+        lines = [
+            f"shovel  {finished}/{snap['total']} done ({snap['succeeded']} ok)  "
+            f"active {snap['active']}/{self.max_workers}  queued {snap['queued']}",
+            f"        {snap['instances_per_hour']:.1f} instances/h  ${snap['cost_usd']:.2f}{cost_per}  "
+            f"ETA {_format_duration(snap['eta_s'])}  elapsed {_format_duration(snap['elapsed_s'])}",
+            "",
+            f"{'slot':<5} {'instance':<48} {'phase':<11} {'turn':>4}  {'phase':>7}  {'total':>7}",
+        ]
+        for slot in snap["slots"]:
+            if slot["instance_id"] is None:
+                lines.append(f"{slot['slot']:<5} (idle)")
+                continue
+            lines.append(
+                f"{slot['slot']:<5} {slot['instance_id'][:48]:<48} {slot['phase']:<11} {slot['turn']:>4}  "
+                f"{_format_duration(slot['phase_elapsed_s']):>7}  {_format_duration(slot['elapsed_s']):>7}"
+            )
+        if snap["statuses"]:
+            lines.append("")
+            lines.append("status: " + ", ".join(f"{k}={v}" for k, v in sorted(snap["statuses"].items())))
+        return "\n".join(lines)
+
+    def write_status_file(self, path: str, snapshot: dict | None = None) -> None:
+        """Atomically rewrite the JSON status file."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot or self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+async def run_progress(
+    tracker: ProgressTracker,
+    live: bool = False,
+    status_file: str | None = None,
+    interval: float = 2.0,
+) -> None:
+    """Refresh the terminal view and/or status file until cancelled.
+
+    On a terminal the view is redrawn in place; otherwise a snapshot is
+    appended every ``APPEND_EVERY`` refreshes, so redirected output stays short.
+    """
+    stream = sys.stderr
+    redraw = stream.isatty()
+    try:
+        for tick in itertools.count():
+            snapshot = tracker.snapshot()
+            if status_file:
+                tracker.write_status_file(status_file, snapshot)
+            if live and (redraw or tick % APPEND_EVERY == 0):
+                # On a terminal, clear the screen and redraw from the top-left corner.
+                stream.write(("\x1b[H\x1b[2J" if redraw else "\n") + tracker.render(snapshot) + "\n")
+                stream.flush()
+            await asyncio.sleep(interval)
+    finally:
+        if status_file:
+            tracker.write_status_file(status_file)
@@ -111,8 +111,8 @@ If validation fails at any step, diagnose and fix your configuration:
 **Step 6: Cleanup**
 ```bash
 docker rmi test_{instance_id} 2>/dev/null || true
-rm -rf {build_dir}
 ```
+Leave {build_dir} in place; Shovel removes it when the instance is done.
 
 ### Phase 4: Output Final Result
 After validation passes, your FINAL assistant message MUST contain the output JSON in this exact wrapper format:
@@ -174,7 +174,7 @@ Analyze this repository and generate Docker environment configuration for testin
 1. Analyze the repository structure, build files, and CI configuration
 2. Generate the Docker configuration (dockerfile, eval_script, setup_repo.sh)
 3. Self-validate by building a Docker image and running eval_script inside the container
-   - Write Dockerfile + setup_repo.sh to {build_dir}/
+   - Write Dockerfile + setup_repo.sh to {build_dir}/ (it already exists; its .dockerignore keeps any other file, such as eval.sh, out of the build context)
    - `docker build` the image
    - `docker run` with eval_script -> tests should FAIL (no fix patch)
    - `docker run` with eval_script + fix patch -> tests should PASS
@@ -188,3 +188,49 @@ Remember:
 - The heredoc delimiter MUST be EOF_114329324912
 - Final answer format MUST be wrapped in `<SHOVEL_OUTPUT_JSON> ... </SHOVEL_OUTPUT_JSON>`
 """
+
+RESUME_PROMPT_TEMPLATE = """## Resuming
+Your previous session for instance {instance_id} was interrupted after {num_turns} turns. Your findings so far are still in this conversation, and Docker images you built may still exist, but the build directory was removed. Use {build_dir}/ as the build directory from now on.
+
+Continue from where you left off. Do not restart the analysis: write your latest Dockerfile and setup_repo.sh into {build_dir}/, finish any remaining validation steps, and then output the final validated configuration.
+
+Remember:
+- Final answer format MUST be wrapped in `<SHOVEL_OUTPUT_JSON> ... </SHOVEL_OUTPUT_JSON>`
+"""
+
+NEXT_INSTANCE_PROMPT_TEMPLATE = """## Next Instance
+You are done with the previous instance. Now generate the configuration for another instance of {repo}, in this same session.
+
+The working directory has already been reset to this instance's base commit {base_commit}. Reuse what you learned about the repository layout, CI setup and dependencies. Dependencies, supported Python versions and test commands may differ between commits, so re-check build files that could have changed, and validate this instance from scratch in its own build directory {build_dir}/. Do not copy the previous instance's test files or patches into this configuration.
+
+{instance_prompt}"""
+
+PRIOR_ATTEMPT_TEMPLATE = """
+## Previous Attempt
+A faster model ({model}) already attempted this instance and did not produce a validated configuration (outcome: {status}). Files it wrote may still be in {build_dir}/. Use its findings as a starting point, but verify everything yourself before relying on it.
+
+{findings}
+"""
+
+SPECULATIVE_ATTEMPT_TEMPLATE = """
+## Parallel Attempt
+Other agents are working on this same instance in parallel, each in its own checkout. To avoid clashing with them:
+- Use only the build directory {build_dir}/
+- Tag your Docker image `{image_tag}` instead of `test_<instance_id>`, and remove only that image when cleaning up
+{hint}
+"""
+
+PACKAGE_CACHE_PROMPT_TEMPLATE = """
+## Local Package Cache
+A caching proxy for PyPI and apt is running on this machine. Route every validation build through it so packages are not downloaded again for each build:
+- In your validation Dockerfile, add these two lines right after the `FROM` line (they are harmless when the build args are not passed, so keep them in the final dockerfile too):
+  ```
+  ARG PIP_INDEX_URL
+  ARG PIP_TRUSTED_HOST
+  ```
+- Build with the cache flags instead of the plain `docker build` shown above:
+  ```bash
+  cd {{build_dir}} && docker build {build_args} -t test_{{instance_id}} .
+  ```
+- Do not hard-code the cache address in setup_repo.sh or eval_script; it only exists during validation.
+"""
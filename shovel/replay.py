@@ -0,0 +1,239 @@
+"""Offline replay: rebuild results from trajectory logs without calling the API.
+
+``shovel replay`` re-runs the current output parsing and post-processing over
+every trajectory JSONL in ``--log-dir``. Use it to regenerate
+``docker_res.json`` after changing that code. With ``--compare`` it also works
+as a regression benchmark for the output pipeline.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from shovel.agent import BUDGET_SUBTYPES, postprocess_output
+from shovel.cascade import static_check_output
+from shovel.ledger import AGENT_ERROR, BUDGET_EXCEEDED, PARSE_FAILED, STATIC_CHECK_FAILED, SUCCESS
+
+logger = logging.getLogger(__name__)
+
+
+def replay_log(path: str) -> dict:
+    """Replay one trajectory log into ``{instance_id, tier, attempt, end_time, status, output}``.
+
+    Resumed sessions append several header/footer segments to one log; like a
+    live run, only the last segment decides the outcome. Lines that are not
+    valid JSON, such as the half-written last line of a killed run, are
+    skipped and counted in ``malformed_lines``.
+    """
+    instance_id = None
+    attempt = 0
+    tier = 0
+    final_tier = True
+    start_time = 0.0
+    end_time = None
+    malformed = 0
+    last_text = None
+    result = None
+    error = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                malformed += 1
+                continue
+            if not isinstance(entry, dict):
+                malformed += 1
+                continue
+            if entry.get("type") == "header":
+                instance_id = entry["instance_id"]
+                attempt = entry.get("attempt") or 0
+                tier = entry.get("tier") or 0
+                final_tier = entry.get("final_tier", True)
+                start_time = entry.get("start_time") or 0.0
+                end_time = last_text = result = error = None
+                continue
+            if entry.get("type") == "footer":
+                end_time = entry.get("end_time")
+                continue
+            role = entry.get("role")
+            if role == "assistant":
+                texts = [block["text"] for block in entry.get("content", []) if block.get("type") == "text"]
+                if texts:
+                    last_text = "\n".join(texts)
+            elif role == "result":
+                result = entry
+            elif role == "error":
+                error = entry.get("error")
+
+    replay = {
+        "path": path,
+        "instance_id": instance_id,
+        "tier": tier,
+        "final_tier": final_tier,
+        "attempt": attempt,
+        "start_time": start_time,
+        "end_time": end_time,
+        "malformed_lines": malformed,
+    }
+    if instance_id is None:
+        return {**replay, "status": None, "output": None}
+
+    output = None
+    if error is not None:
+        status = AGENT_ERROR
+    elif result is not None and result.get("is_error"):
+        status = BUDGET_EXCEEDED if result.get("subtype") in BUDGET_SUBTYPES else AGENT_ERROR
+    else:
+        output = postprocess_output(instance_id, last_text)
+        status = SUCCESS if output is not None else PARSE_FAILED
+    return {**replay, "status": status, "output": output}
+
+
+def _is_validated(replay: dict) -> bool:
+    return replay["status"] == SUCCESS and not static_check_output(replay["output"])
+
+
+def _pick(replays: list[dict]) -> dict:
+    """Pick an instance's outcome from its logs the way the live run did.
+
+    A cascade stops at the first tier that succeeds, so the most recently
+    started tier decides. Its speculative attempts race: in the order they
+    finished, the first that passes the static checks wins, else the first
+    with output, else the last to finish. Outside the final tier a config
+    failing the static checks counts as failed.
+    """
+    last = max(replays, key=lambda r: r["start_time"])
+    # A log without a footer was cut off mid-run, after the others finished.
+    finished = sorted(
+        (r for r in replays if r["tier"] == last["tier"]),
+        key=lambda r: (r["end_time"] is None, r["end_time"] or 0.0),
+    )
+    chosen = finished[0]
+    if len(finished) > 1:
+        chosen = next(
+            (r for r in finished if _is_validated(r)),
+            next((r for r in finished if r["output"] is not None), finished[-1]),
+        )
+    if chosen["output"] is not None and not chosen["final_tier"] and static_check_output(chosen["output"]):
+        return {**chosen, "status": STATIC_CHECK_FAILED}
+    return chosen
+
+
+def replay_logs(log_dir: str, workers: int | None = None) -> tuple[dict[str, dict], dict[str, str]]:
+    """Replay every log in ``log_dir`` across processes.
+
+    Returns results in the ``docker_res.json`` format and the status per instance.
+    """
+    paths = sorted(
+        os.path.join(log_dir, name) for name in os.listdir(log_dir) if name.endswith(".jsonl")
+    )
+    # A few chunks per worker keeps IPC overhead low on directories of 10k+ logs.
+    chunksize = max(1, len(paths) // (8 * (workers or os.cpu_count() or 1)))
+    by_instance: dict[str, list[dict]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for replay in pool.map(replay_log, paths, chunksize=chunksize):
+            if replay["malformed_lines"]:
+                logger.warning("Skipped %s malformed lines in %s", replay["malformed_lines"], replay["path"])
+            if replay["instance_id"] is None:
+                logger.warning("Skipping %s: no header line", replay["path"])
+                continue
+            by_instance.setdefault(replay["instance_id"], []).append(replay)
+
+    results: dict[str, dict] = {}
+    statuses: dict[str, str] = {}
+    for instance_id, replays in by_instance.items():
+        chosen = _pick(replays)
+        result = dict(chosen["output"]) if chosen["output"] is not None else {}
+        result["instance_id"] = instance_id
+        results[instance_id] = result
+        statuses[instance_id] = chosen["status"]
+    return results, statuses
+
+
+def compare_results(new: dict[str, dict], old: dict[str, dict]) -> dict[str, list[str]]:
+    """Group instance ids by how the replayed result differs from ``old``."""
+    diff: dict[str, list[str]] = {"unchanged": [], "changed": [], "added": [], "missing": []}
+    for instance_id, result in new.items():
+        if instance_id not in old:
+            diff["added"].append(instance_id)
+        elif old[instance_id] == result:
+            diff["unchanged"].append(instance_id)
+        else:
+            diff["changed"].append(instance_id)
+    diff["missing"] = [instance_id for instance_id in old if instance_id not in new]
+    return diff
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the parser for ``shovel replay``."""
+    parser = argparse.ArgumentParser(
+        prog="shovel replay",
+        description="Rebuild results from trajectory logs with the current post-processing (no API calls)",
+    )
+    parser.add_argument("--log-dir", default="./logs", help="Directory of agent trajectory logs")
+    parser.add_argument("--output", default="docker_res.replay.json", help="Output JSON file path")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--compare", default=None, help="Existing results JSON to diff the replay against")
+    parser.add_argument("--store", default=None, metavar="DIR", help="Also write results to a result store")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log per-instance parse messages")
+    return parser
+
+
+def main(argv: list[str]) -> int:
+    """Entry point for ``shovel replay``."""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        datefmt="%H:%M:%S",
+    )
+    if not args.verbose:
+        logging.getLogger("shovel.agent").setLevel(logging.CRITICAL)
+
+    start = time.perf_counter()
+    results, statuses = replay_logs(args.log_dir, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.store:
+        from shovel.store import ResultStore
+
+        ResultStore(args.store).import_results(results)
+
+    counts: dict[str, int] = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    logger.info(
+        "Replayed %s instances in %.2fs (%.0f/s), saved to %s",
+        len(results),
+        elapsed,
+        len(results) / elapsed if elapsed else 0.0,
+        args.output,
+    )
+    logger.info("Status: %s", ", ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        diff = compare_results(results, old)
+        logger.info(
+            "Compared with %s: %s unchanged, %s changed, %s added, %s missing",
+            args.compare,
+            len(diff["unchanged"]),
+            len(diff["changed"]),
+            len(diff["added"]),
+            len(diff["missing"]),
+        )
+        for instance_id in diff["changed"][:20]:
+            logger.info("  changed: %s", instance_id)
+        return 1 if diff["changed"] else 0
+    return 0
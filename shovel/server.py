@@ -0,0 +1,418 @@
+"""Long-running Shovel daemon that accepts jobs over a local socket.
+
+``shovel serve`` keeps the SDK imported, loaded inputs and cloned repos warm
+and runs every submitted job under one shared concurrency budget. Clients talk
+newline-delimited JSON over a Unix socket (or local TCP port): each request is
+one JSON object, and the server streams events back until the job is done.
+
+Requests::
+
+    {"op": "submit", "input": "data.jsonl", "instance_ids": ["..."], "output": "res.json"}
+    {"op": "submit", "instances": [{"instance_id": "...", "repo": "...", ...}]}
+    {"op": "status"}
+
+A submit request accepts the same selection fields as the CLI (``input``,
+``split``, ``instance_ids``, ``start``, ``end``, ``where``) plus optional ``model``,
+``max_turns``, ``output`` and ``resume``. Events are ``accepted``, one
+``result`` per finished instance, and ``done``; failures are reported as
+``error``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+from shovel.cache import DEFAULT_PYPI_UPSTREAM, PackageCache
+from shovel.cli import RunConfig, _filter_instances, configure_logging, run_pipeline
+from shovel.ledger import default_ledger_path
+from shovel.metadata import MetadataIndex
+from shovel.utils import load_instances
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "./shovel.sock"
+
+# StreamReader line limit; inline instances carry whole patches.
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class ServeConfig:
+    socket: str | None
+    host: str
+    port: int | None
+    repo_dir: str
+    model: str
+    max_workers: int
+    max_turns: int
+    log_dir: str | None = "./logs"
+    checkpoint_dir: str | None = "./checkpoints"
+    ledger: str | None = "./shovel_serve.status.jsonl"
+    package_cache_dir: str | None = None
+    pypi_upstream: str = DEFAULT_PYPI_UPSTREAM
+    workspace_root: str | None = None
+    metadata_dir: str = "./metadata"
+
+
+class ShovelServer:
+    """Job server sharing one worker budget and warm caches across submissions."""
+
+    def __init__(self, cfg: ServeConfig):
+        self.cfg = cfg
+        self.semaphore = asyncio.Semaphore(cfg.max_workers)
+        self.jobs: dict[str, dict] = {}
+        self._job_counter = itertools.count(1)
+        self._input_cache: dict[tuple[str, str | None], tuple[float | None, dict[str, dict]]] = {}
+        self._indexes: dict[tuple[str, str | None], MetadataIndex] = {}
+        self.package_cache = None
+        if cfg.package_cache_dir is not None:
+            self.package_cache = PackageCache(cfg.package_cache_dir, pypi_upstream=cfg.pypi_upstream)
+
+    def warm_up(self) -> None:
+        """Import heavy optional dependencies once so jobs start immediately."""
+        try:
+            from shovel.agent import _sdk_symbols
+
+            _sdk_symbols()
+        except ImportError as exc:
+            logger.warning("Claude Agent SDK not importable, jobs will fail: %s", exc)
+        try:
+            import datasets  # noqa: F401
+        except ImportError:
+            logger.debug("datasets not installed; HuggingFace inputs unavailable")
+        os.makedirs(self.cfg.repo_dir, exist_ok=True)
+        if self.package_cache is not None:
+            self.package_cache.start()
+
+    def _load_input(self, path: str, split: str | None) -> dict[str, dict]:
+        """Load an input, reusing the cached copy unless the file changed."""
+        key = (path, split)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cached = self._input_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        instances = load_instances(path, split=split)
+        self._input_cache[key] = (mtime, instances)
+        logger.info("Cached %s instances from %s", len(instances), path)
+        return instances
+
+    def _metadata_index(self, path: str, split: str | None) -> MetadataIndex:
+        """Metadata index of an input, keeping loaded columns until the file changes."""
+        index = MetadataIndex(path, self.cfg.metadata_dir, split)
+        cached = self._indexes.get((path, split))
+        if cached is not None and cached.dir == index.dir:
+            return cached
+        self._indexes[(path, split)] = index
+        return index
+
+    def _select_input(self, job_cfg: RunConfig) -> tuple[dict[str, dict], MetadataIndex]:
+        """Load and select a job's instances, filtering ``--where`` with the cached index."""
+        instances = self._load_input(job_cfg.input, job_cfg.split)
+        index = self._metadata_index(job_cfg.input, job_cfg.split)
+        if job_cfg.where:
+            index.ensure_built()
+            ids = index.column("instance_id")
+            instances = {ids[row]: instances[ids[row]] for row in index.where(job_cfg.where)}
+        return _filter_instances(instances, job_cfg, where=False), index
+
+    def _job_config(self, request: dict) -> RunConfig:
+        cfg = self.cfg
+        output = request.get("output")
+        return RunConfig(
+            input=request.get("input") or "<inline>",
+            output=output,
+            repo_dir=cfg.repo_dir,
+            model=request.get("model") or cfg.model,
+            max_workers=cfg.max_workers,
+            max_turns=int(request.get("max_turns") or cfg.max_turns),
+            split=request.get("split"),
+            instance_ids=request.get("instance_ids"),
+            start=request.get("start"),
+            end=request.get("end"),
+            where=request.get("where"),
+            metadata_dir=cfg.metadata_dir,
+            log_dir=cfg.log_dir,
+            resume=bool(request.get("resume")),
+            checkpoint_dir=cfg.checkpoint_dir,
+            ledger=default_ledger_path(output) if output else cfg.ledger,
+            workspace_root=cfg.workspace_root,
+        )
+
+    async def _run_job(self, request: dict, send) -> None:
+        job_cfg = self._job_config(request)
+        index = None
+        if request.get("instances"):
+            instances = {item["instance_id"]: item for item in request["instances"]}
+            instances = _filter_instances(instances, job_cfg)
+        elif request.get("input"):
+            loop = asyncio.get_running_loop()
+            instances, index = await loop.run_in_executor(None, self._select_input, job_cfg)
+        else:
+            raise ValueError("submit needs 'input' or 'instances'")
+
+        job_id = f"job-{next(self._job_counter)}"
+        job = {
+            "job_id": job_id,
+            "total": len(instances),
+            "completed": 0,
+            "submitted_at": time.time(),
+            "status_counts": {},
+        }
+        self.jobs[job_id] = job
+        await send({"event": "accepted", "job_id": job_id, "total": len(instances)})
+
+        async def on_result(instance_id: str, result: dict, status: str | None) -> None:
+            job["completed"] += 1
+            job["status_counts"][status] = job["status_counts"].get(status, 0) + 1
+            await send(
+                {
+                    "event": "result",
+                    "job_id": job_id,
+                    "instance_id": instance_id,
+                    "status": status,
+                    "result": result,
+                }
+            )
+
+        try:
+            await run_pipeline(
+                job_cfg,
+                instances=instances,
+                semaphore=self.semaphore,
+                on_result=on_result,
+                handle_signals=False,
+                package_cache=self.package_cache,
+                preselected=True,
+                index=index,
+            )
+        finally:
+            job["finished_at"] = time.time()
+            self.jobs.pop(job_id, None)
+        await send(
+            {
+                "event": "done",
+                "job_id": job_id,
+                "completed": job["completed"],
+                "total": job["total"],
+                "status_counts": job["status_counts"],
+                "duration_s": round(job["finished_at"] - job["submitted_at"], 2),
+            }
+        )
+
+    def _status(self) -> dict:
+        running = list(self.jobs.values())
+        return {
+            "event": "status",
+            "max_workers": self.cfg.max_workers,
+            "free_workers": self.semaphore._value,
+            "queued": sum(job["total"] - job["completed"] for job in running),
+            "jobs": running,
+        }
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve requests from one client connection until it disconnects."""
+
+        async def send(event: dict) -> None:
+            writer.write((json.dumps(event, ensure_ascii=False) + "\n").encode())
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    op = request.get("op")
+                    if op == "submit":
+                        await self._run_job(request, send)
+                    elif op == "status":
+                        await send(self._status())
+                    else:
+                        await send({"event": "error", "error": f"unknown op: {op!r}"})
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as exc:
+                    logger.error("Request failed: %s", exc)
+                    await send({"event": "error", "error": str(exc)})
+        except ConnectionError:
+            logger.warning("Client disconnected; its in-flight job was cancelled")
+        finally:
+            writer.close()
+
+    async def serve_forever(self) -> None:
+        """Bind the socket and serve until cancelled."""
+        if self.cfg.port is not None and not is_loopback_host(self.cfg.host):
+            # Jobs run agents with bypassed permissions and write wherever the client asks.
+            raise ValueError(f"Refusing to serve on non-loopback host {self.cfg.host!r}")
+        self.warm_up()
+        if self.cfg.port is not None:
+            server = await asyncio.start_server(
+                self.handle_client, self.cfg.host, self.cfg.port, limit=MAX_REQUEST_BYTES
+            )
+            address = f"{self.cfg.host}:{self.cfg.port}"
+        else:
+            if os.path.exists(self.cfg.socket):
+                os.remove(self.cfg.socket)
+            server = await asyncio.start_unix_server(self.handle_client, self.cfg.socket, limit=MAX_REQUEST_BYTES)
+            address = self.cfg.socket
+        logger.info("Shovel server listening on %s (max_workers=%s)", address, self.cfg.max_workers)
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                if self.cfg.port is None and os.path.exists(self.cfg.socket):
+                    os.remove(self.cfg.socket)
+
+
+async def submit(request: dict, socket_path: str | None = None, host: str = "127.0.0.1", port: int | None = None):
+    """Send one request to a running server and yield its events until the job ends."""
+    if port is not None:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_REQUEST_BYTES)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path or DEFAULT_SOCKET, limit=MAX_REQUEST_BYTES)
+    try:
+        writer.write((json.dumps(request) + "\n").encode())
+        await writer.drain()
+        while line := await reader.readline():
+            event = json.loads(line)
+            yield event
+            if event["event"] in ("done", "error", "status"):
+                break
+    finally:
+        writer.close()
+
+
+def is_loopback_host(host: str) -> bool:
+    """Whether ``host`` only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _add_address_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP loopback host (used with --port)")
+    parser.add_argument("--port", type=int, default=None, help="Serve on a local TCP port instead of a Unix socket")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the parser for the serve/submit subcommands."""
+    parser = argparse.ArgumentParser(prog="shovel", description="Shovel job server and client")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Run a long-lived job server")
+    _add_address_args(serve)
+    serve.add_argument("--repo-dir", default="./repo", help="Directory for cloning repos")
+    serve.add_argument("--model", default="claude-sonnet-4-5-20250929", help="Default Claude model")
+    serve.add_argument("--max-workers", type=int, default=4, help="Maximum concurrent agents across all jobs")
+    serve.add_argument("--max-turns", type=int, default=100, help="Default maximum agent turns per instance")
+    serve.add_argument("--log-dir", default="./logs", help="Directory to save agent trajectory logs")
+    serve.add_argument("--checkpoint-dir", default="./checkpoints", help="Directory for agent session checkpoints")
+    serve.add_argument(
+        "--ledger",
+        default="./shovel_serve.status.jsonl",
+        help="Status ledger for jobs submitted without an output file",
+    )
+    serve.add_argument(
+        "--package-cache",
+        default=None,
+        metavar="DIR",
+        help="Run a local PyPI/apt caching proxy shared by all jobs, storing packages in DIR",
+    )
+    serve.add_argument("--pypi-upstream", default=DEFAULT_PYPI_UPSTREAM, help="Index the package cache mirrors")
+    serve.add_argument("--workspace-root", default=None, help="Root for per-job Docker build dirs")
+    serve.add_argument(
+        "--metadata-dir",
+        default="./metadata",
+        help="Directory for the precomputed instance metadata used by --where",
+    )
+    serve.add_argument("--verbose", "-v", action="store_true", help="Enable verbose logging")
+
+    client = subparsers.add_parser("submit", help="Submit a job to a running server and stream results")
+    _add_address_args(client)
+    client.add_argument("--input", default=None, help="Input dataset path (JSON/JSONL) or HuggingFace dataset name")
+    client.add_argument("--output", default=None, help="Output JSON file the server writes results to")
+    client.add_argument("--split", default=None, help="Dataset split (for HuggingFace datasets)")
+    client.add_argument("--instance-ids", nargs="+", default=None, help="Process only specific instance IDs")
+    client.add_argument("--start", type=int, default=None, help="Start index (1-based) of instances to process")
+    client.add_argument("--end", type=int, default=None, help="End index (1-based, inclusive) of instances to process")
+    client.add_argument(
+        "--where",
+        default=None,
+        metavar="EXPR",
+        help="Process only instances matching a metadata filter",
+    )
+    client.add_argument("--model", default=None, help="Override the server's default model")
+    client.add_argument("--max-turns", type=int, default=None, help="Override the server's default max turns")
+    client.add_argument("--resume", action="store_true", help="Skip instances already in --output")
+    client.add_argument("--status", action="store_true", help="Print server status instead of submitting")
+    return parser
+
+
+async def _run_client(args: argparse.Namespace) -> int:
+    if args.status:
+        request = {"op": "status"}
+    else:
+        request = {
+            "op": "submit",
+            "input": os.path.abspath(args.input) if args.input and os.path.exists(args.input) else args.input,
+            "output": os.path.abspath(args.output) if args.output else None,
+            "split": args.split,
+            "instance_ids": args.instance_ids,
+            "start": args.start,
+            "end": args.end,
+            "where": args.where,
+            "model": args.model,
+            "max_turns": args.max_turns,
+            "resume": args.resume,
+        }
+    exit_code = 0
+    async for event in submit(request, socket_path=args.socket, host=args.host, port=args.port):
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+        if event["event"] == "error":
+            exit_code = 1
+    return exit_code
+
+
+def main(argv: list[str]) -> int:
+    """Entry point for ``shovel serve`` and ``shovel submit``."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "submit":
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        return asyncio.run(_run_client(args))
+
+    if args.port is not None and not is_loopback_host(args.host):
+        parser.error(f"--host must be a loopback address, got {args.host!r}: the server has no authentication")
+    configure_logging(args.verbose)
+    cfg = ServeConfig(
+        socket=args.socket,
+        host=args.host,
+        port=args.port,
+        repo_dir=args.repo_dir,
+        model=args.model,
+        max_workers=args.max_workers,
+        max_turns=args.max_turns,
+        log_dir=args.log_dir,
+        checkpoint_dir=args.checkpoint_dir,
+        ledger=args.ledger,
+        package_cache_dir=args.package_cache,
+        pypi_upstream=args.pypi_upstream,
+        workspace_root=args.workspace_root,
+        metadata_dir=args.metadata_dir,
+    )
+    try:
+        asyncio.run(ShovelServer(cfg).serve_forever())
+    except KeyboardInterrupt:
+        logger.info("Shovel server stopped")
+    return 0
@@ -0,0 +1,140 @@
+"""Speculative parallel agent attempts for historically hard instances."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import shutil
+import subprocess
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from shovel.agent import AgentRun, image_tag_for
+from shovel.ledger import SUCCESS, StatusLedger
+from shovel.utils import clone_repo
+from shovel.workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+# Prompt hints that push parallel attempts down different paths. The SDK has no
+# sampling seed, so varying the hint (and optionally the model) is what makes
+# the attempts independent.
+ATTEMPT_HINTS = [
+    "- Strategy hint: follow the project's CI workflow files as literally as possible.",
+    "- Strategy hint: pick the base image and dependency versions that match the base commit's date; "
+    "pin old versions aggressively.",
+    "- Strategy hint: start from the project's tox.ini / noxfile / Makefile test targets.",
+    "- Strategy hint: prefer the minimal install (editable install plus test requirements) and add "
+    "system packages only when a build error demands it.",
+]
+
+
+@dataclass
+class SpeculationConfig:
+    attempts: int = 2
+    repos: set[str] = field(default_factory=set)
+    below_success_rate: float | None = None
+    min_history: int = 3
+    models: list[str] | None = None
+    max_extra_attempts: int = 2
+
+
+def flag_hard_repos(instances: dict[str, dict], ledger: StatusLedger, cfg: SpeculationConfig) -> set[str]:
+    """Repos flagged for speculation: listed explicitly or with low first-attempt success."""
+    flagged = set(cfg.repos)
+    if cfg.below_success_rate is None:
+        return flagged
+    history: dict[str, list[int]] = {}
+    for instance_id, instance in instances.items():
+        entry = ledger.entries.get(instance_id)
+        if entry is None or entry.get("first_status") is None:
+            continue
+        counts = history.setdefault(instance["repo"], [0, 0])
+        counts[0] += int(entry["first_status"] == SUCCESS)
+        counts[1] += 1
+    for repo, (successes, total) in history.items():
+        if total >= cfg.min_history and successes / total < cfg.below_success_rate:
+            flagged.add(repo)
+    if flagged:
+        logger.info("Speculating on %s repos: %s", len(flagged), ", ".join(sorted(flagged)))
+    return flagged
+
+
+def _cleanup_attempt(instance_id: str, attempt: int, repo_dir: str | None, workspace: Workspace) -> None:
+    """Remove a speculative attempt's checkout, build dir and Docker image."""
+    if repo_dir is not None:
+        shutil.rmtree(repo_dir, ignore_errors=True)
+    workspace.release(instance_id, attempt)
+    try:
+        subprocess.run(
+            ["docker", "rmi", "-f", image_tag_for(instance_id, attempt)],
+            capture_output=True,
+            timeout=60,
+        )
+    except Exception:
+        pass
+
+
+async def race_attempts(
+    instance: dict,
+    repo_dir: str,
+    repo_root_dir: str,
+    workspace: Workspace,
+    cfg: SpeculationConfig,
+    extra_slots: asyncio.Semaphore,
+    run_attempt: Callable[[int, str, str | None], Awaitable[AgentRun]],
+    is_validated: Callable[[AgentRun], bool],
+) -> AgentRun:
+    """Run up to ``cfg.attempts`` agents in parallel and return the first validated run.
+
+    Attempt 0 uses the instance's regular checkout and slot. Each extra attempt
+    needs a free slot in ``extra_slots`` (the global speculation cap) and gets a
+    local clone of the checkout; when no slot is free, fewer attempts run rather
+    than waiting. Losing attempts are cancelled and every extra checkout, build
+    dir and image is removed. If no attempt validates, the first run with output
+    (or the last run) is returned.
+    """
+    instance_id = instance["instance_id"]
+    extras = 0
+    while extras < cfg.attempts - 1 and not extra_slots.locked():
+        await extra_slots.acquire()
+        extras += 1
+
+    loop = asyncio.get_running_loop()
+    checkouts: dict[int, str | None] = {0: repo_dir}
+    tasks: dict[asyncio.Task, int] = {}
+    try:
+        for attempt in range(1, extras + 1):
+            checkouts[attempt] = await loop.run_in_executor(
+                None, clone_repo, instance, repo_root_dir, repo_dir, f"__attempt{attempt}__{workspace.run_id}"
+            )
+        attempts = [attempt for attempt, path in checkouts.items() if path is not None]
+        logger.info("[%s] Speculating with %s parallel attempts", instance_id, len(attempts))
+        for attempt in attempts:
+            hint = ATTEMPT_HINTS[(attempt - 1) % len(ATTEMPT_HINTS)] if attempt else None
+            task = asyncio.create_task(run_attempt(attempt, checkouts[attempt], hint))
+            tasks[task] = attempt
+
+        finished: list[AgentRun] = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                run = task.result()
+                finished.append(run)
+                if is_validated(run):
+                    logger.info("[%s] Attempt %s won; cancelling %s others", instance_id, tasks[task], len(pending))
+                    return run
+        logger.warning("[%s] No speculative attempt validated", instance_id)
+        return next((run for run in finished if run.output is not None), finished[-1])
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for _ in range(extras):
+            extra_slots.release()
+        for attempt in range(1, extras + 1):
+            await loop.run_in_executor(
+                None, _cleanup_attempt, instance_id, attempt, checkouts.get(attempt), workspace
+            )
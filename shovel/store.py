@@ -0,0 +1,204 @@
+"""Content-addressed, sharded result store.
+
+Configs for instances of one repo are often byte-identical, so the store keeps
+every unique script once and points per-instance manifests at it::
+
+    <root>/blobs/<hh>/<sha256>                   one file per unique text
+    <root>/manifests/<hh>/<instance_id>.json     result with text fields as {"$blob": sha256}
+
+Manifests are sharded by a hash of the instance id, so one instance can be read
+without touching the rest. Blobs loaded through a store are shared between all
+results that reference them, so a fully loaded store holds each script in
+memory once. ``export`` writes today's monolithic ``docker_res.json`` format.
+
+Result keys starting with ``$`` get an extra ``$`` in manifests, so a
+``{"$blob": ...}`` dict in a manifest is always a blob reference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Result fields kept inline in the manifest rather than moved to blobs.
+INLINE_FIELDS = ("instance_id",)
+
+BLOB_KEY = "$blob"
+
+
+def _shard(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()[:2]
+
+
+def _escape_key(key: str) -> str:
+    return f"${key}" if key.startswith("$") else key
+
+
+def _unescape_key(key: str) -> str:
+    return key[1:] if key.startswith("$") else key
+
+
+def _atomic_write(path: str, data: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResultStore:
+    """Result store keeping unique scripts once, keyed by their SHA-256."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.manifest_dir = os.path.join(root, "manifests")
+        self._blobs: dict[str, str] = {}
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _manifest_path(self, instance_id: str) -> str:
+        safe_id = instance_id.replace("/", "__")
+        return os.path.join(self.manifest_dir, _shard(instance_id), f"{safe_id}.json")
+
+    def _put_blob(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        if digest in self._blobs:
+            return digest
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _atomic_write(path, text)
+        self._blobs[digest] = text
+        return digest
+
+    def _get_blob(self, digest: str) -> str:
+        text = self._blobs.get(digest)
+        if text is None:
+            with open(self._blob_path(digest)) as f:
+                text = f.read()
+            self._blobs[digest] = text
+        return text
+
+    def _to_manifest(self, value, key: str | None = None):
+        if isinstance(value, dict):
+            return {_escape_key(k): self._to_manifest(v, k) for k, v in value.items()}
+        if isinstance(value, str) and key not in INLINE_FIELDS:
+            return {BLOB_KEY: self._put_blob(value)}
+        return value
+
+    def _from_manifest(self, value):
+        if isinstance(value, dict):
+            if set(value) == {BLOB_KEY}:
+                return self._get_blob(value[BLOB_KEY])
+            return {_unescape_key(k): self._from_manifest(v) for k, v in value.items()}
+        return value
+
+    def put(self, instance_id: str, result: dict) -> None:
+        """Store one result, writing only blobs that are not stored yet."""
+        manifest = self._to_manifest(result)
+        path = self._manifest_path(instance_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _atomic_write(path, json.dumps(manifest, ensure_ascii=False))
+
+    def get(self, instance_id: str) -> dict | None:
+        """Read one result, or None if the instance is not stored."""
+        path = self._manifest_path(instance_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return self._from_manifest(json.load(f))
+
+    def instance_ids(self) -> list[str]:
+        """Ids of all stored instances."""
+        ids = []
+        if not os.path.isdir(self.manifest_dir):
+            return ids
+        for shard in sorted(os.listdir(self.manifest_dir)):
+            shard_dir = os.path.join(self.manifest_dir, shard)
+            for name in sorted(os.listdir(shard_dir)):
+                if name.endswith(".json"):
+                    with open(os.path.join(shard_dir, name)) as f:
+                        ids.append(json.load(f)["instance_id"])
+        return ids
+
+    def load_all(self) -> dict[str, dict]:
+        """Load every result; identical scripts share one string object."""
+        results = {}
+        if not os.path.isdir(self.manifest_dir):
+            return results
+        for shard in sorted(os.listdir(self.manifest_dir)):
+            shard_dir = os.path.join(self.manifest_dir, shard)
+            for name in sorted(os.listdir(shard_dir)):
+                if not name.endswith(".json"):
+                    continue
+                with open(os.path.join(shard_dir, name)) as f:
+                    result = self._from_manifest(json.load(f))
+                results[result["instance_id"]] = result
+        return results
+
+    def import_results(self, results: dict[str, dict]) -> None:
+        """Add results in the ``docker_res.json`` format."""
+        for instance_id, result in results.items():
+            self.put(instance_id, result)
+
+    def export(self, output: str) -> int:
+        """Write all results in the ``docker_res.json`` format; returns the count."""
+        results = self.load_all()
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        return len(results)
+
+    def stats(self) -> dict[str, int]:
+        """Instance and blob counts plus on-disk blob bytes."""
+        blob_count = 0
+        blob_bytes = 0
+        if os.path.isdir(self.blob_dir):
+            for shard in os.listdir(self.blob_dir):
+                shard_dir = os.path.join(self.blob_dir, shard)
+                for name in os.listdir(shard_dir):
+                    if name.endswith(".tmp"):
+                        continue
+                    blob_count += 1
+                    blob_bytes += os.path.getsize(os.path.join(shard_dir, name))
+        return {"instances": len(self.instance_ids()), "blobs": blob_count, "blob_bytes": blob_bytes}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the parser for the ``shovel store`` subcommand."""
+    parser = argparse.ArgumentParser(prog="shovel store", description="Manage a content-addressed result store")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    export = subparsers.add_parser("export", help="Write the store as a docker_res.json-style file")
+    export.add_argument("--store", required=True, help="Result store directory")
+    export.add_argument("--output", default="docker_res.json", help="Output JSON file path")
+    ingest = subparsers.add_parser("import", help="Add results from a docker_res.json-style file")
+    ingest.add_argument("--store", required=True, help="Result store directory")
+    ingest.add_argument("--input", required=True, help="Results JSON file to import")
+    stats = subparsers.add_parser("stats", help="Show instance and unique-script counts")
+    stats.add_argument("--store", required=True, help="Result store directory")
+    return parser
+
+
+def main(argv: list[str]) -> int:
+    """Entry point for ``shovel store``."""
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    store = ResultStore(args.store)
+    if args.action == "export":
+        count = store.export(args.output)
+        logger.info("Exported %s results from %s to %s", count, args.store, args.output)
+    elif args.action == "import":
+        with open(args.input) as f:
+            results = json.load(f)
+        store.import_results(results)
+        logger.info("Imported %s results from %s into %s", len(results), args.input, args.store)
+    else:
+        json.dump(store.stats(), sys.stdout, indent=2)
+        print()
+    return 0
@@ -39,12 +39,24 @@ def load_instances(dataset: str, split: str | None = None) -> dict[str, dict]:
     return {item["instance_id"]: item for item in ds}
 
 
-def clone_repo(instance: dict, repo_root_dir: str) -> str | None:
-    """Clone and checkout the repo for an instance."""
+def clone_repo(
+    instance: dict,
+    repo_root_dir: str,
+    source: str | None = None,
+    suffix: str = "",
+    name: str | None = None,
+) -> str | None:
+    """Clone and checkout the repo for an instance.
+
+    ``source`` clones from an existing local checkout instead of GitHub, and
+    ``suffix`` is appended to the checkout directory name so several checkouts
+    of one instance can coexist. ``name`` replaces the directory name, e.g. for
+    a checkout that a batch of instances resets in turn.
+    """
     instance_id = instance["instance_id"]
     repo = instance["repo"]
     base_commit = instance["base_commit"]
-    repo_dir = os.path.join(repo_root_dir, instance_id)
+    repo_dir = os.path.join(repo_root_dir, (name or instance_id) + suffix)
 
     if os.path.isdir(repo_dir):
         logger.info("[%s] Repo dir exists, resetting to %s", instance_id, base_commit[:8])
@@ -68,10 +80,10 @@ def clone_repo(instance: dict, repo_root_dir: str) -> str | None:
             logger.error("[%s] Reset failed: %s", instance_id, exc)
             shutil.rmtree(repo_dir, ignore_errors=True)
 
-    logger.info("[%s] Cloning %s@%s", instance_id, repo, base_commit[:8])
+    logger.info("[%s] Cloning %s@%s", instance_id, source or repo, base_commit[:8])
     try:
         subprocess.run(
-            ["git", "clone", "-o", "origin", f"https://github.com/{repo}", repo_dir],
+            ["git", "clone", "-o", "origin", source or f"https://github.com/{repo}", repo_dir],
             check=True,
             capture_output=True,
             timeout=300,
@@ -131,10 +143,9 @@ def detect_language(files: list[str]) -> str:
     """Detect the primary language from file extensions."""
     lang_counts: dict[str, int] = {}
     for file_path in files:
-        for ext, lang in EXTENSION_TO_LANGUAGE.items():
-            if file_path.endswith(ext):
-                lang_counts[lang] = lang_counts.get(lang, 0) + 1
-                break
+        lang = EXTENSION_TO_LANGUAGE.get(os.path.splitext(file_path)[1])
+        if lang is not None:
+            lang_counts[lang] = lang_counts.get(lang, 0) + 1
     if not lang_counts:
         return "python"
     return max(lang_counts, key=lang_counts.get)
@@ -0,0 +1,80 @@
+"""Per-run workspace for the Docker build contexts agents validate with.
+
+Each run gets its own namespace under a configurable root, so concurrent runs
+never share build directories. Point the root at a tmpfs such as ``/dev/shm``
+to keep build-context churn off disk. Each agent attempt gets its own build
+directory, named after a sanitized instance id. The directory comes with a
+generated ``.dockerignore`` so ``docker build`` only uploads ``Dockerfile`` and
+``setup_repo.sh``, even when eval scripts or logs are written next to them.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+DOCKERIGNORE = """\
+# Generated by shovel: send only the build inputs to the Docker daemon.
+*
+!Dockerfile
+!setup_repo.sh
+"""
+
+UNSAFE_CHARS_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def default_workspace_root() -> str:
+    """``/dev/shm/shovel`` when a writable tmpfs is available, else the temp dir."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm/shovel"
+    return os.path.join(tempfile.gettempdir(), "shovel")
+
+
+def safe_name(instance_id: str) -> str:
+    """Directory-safe form of an instance id, unique even after replacing characters."""
+    name = UNSAFE_CHARS_RE.sub("_", instance_id)
+    if name != instance_id:
+        name += "-" + hashlib.sha256(instance_id.encode()).hexdigest()[:8]
+    return name
+
+
+class Workspace:
+    """Build directories of one run, under ``<root>/<run_id>/``."""
+
+    def __init__(self, root: str | None = None, run_id: str | None = None):
+        self.root = os.path.abspath(root or default_workspace_root())
+        self.run_id = run_id or f"run-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{secrets.token_hex(3)}"
+        self.dir = os.path.join(self.root, self.run_id)
+
+    def build_dir(self, instance_id: str, attempt: int = 0) -> str:
+        """Build directory for one agent attempt on an instance."""
+        name = safe_name(instance_id)
+        if attempt:
+            name += f"_attempt{attempt}"
+        return os.path.join(self.dir, name)
+
+    def allocate(self, instance_id: str, attempt: int = 0) -> str:
+        """Create the build directory with its ``.dockerignore``; existing files are kept."""
+        path = self.build_dir(instance_id, attempt)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, ".dockerignore"), "w") as f:
+            f.write(DOCKERIGNORE)
+        return path
+
+    def release(self, instance_id: str, attempt: int = 0) -> None:
+        """Remove an attempt's build directory."""
+        shutil.rmtree(self.build_dir(instance_id, attempt), ignore_errors=True)
+
+    def cleanup(self) -> None:
+        """Remove the whole run namespace, including directories never released."""
+        if os.path.isdir(self.dir):
+            shutil.rmtree(self.dir, ignore_errors=True)
+            logger.info("Removed build workspace %s", self.dir)